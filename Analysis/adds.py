@@ -3,19 +3,229 @@
 # loss of useful data.
 
 import reads
+import catalog
+import failures
+import generators
 import pandas as pd
 import numpy as np
 import os
 import typing
-import cv2
-import math
-
-# Get the cleaned master data
-def get_master(from_cache=True):
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Memoized results of the get_master functions, keyed by function and arguments.
+# Each entry stores the version of the source files it was built from, and is
+# rebuilt when that version changes. This lets the Streamlit app call these
+# functions from every panel without rereading files on each rerun
+pipeline_cache = {}
+pipeline_cache_lock = threading.Lock()
+
+# Get a version of the files, which changes when any of them is modified,
+# added, or removed
+def get_files_version(file_paths: list):
+    version = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            version.append((file_path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append((file_path, None, None))
+
+    return tuple(version)
+
+# Get a version of the CSV files of the kinds in the catalog, see
+# get_files_version
+def get_catalog_version(kinds: list):
+    files = catalog.get_catalog_csv_files(kinds)
+    return tuple(files[catalog.catalog_scan_columns].itertuples(index=False, name=None))
+
+# Get the memoized result of build for key, calling build if there is no result
+# for this version yet. A shallow copy is returned, so the data is shared, but
+# callers adding or dropping columns don't change the memoized result
+def memoize(key: tuple, version: tuple, build: typing.Callable):
+    with pipeline_cache_lock:
+        entry = pipeline_cache.get(key)
+
+    if entry is None or entry[0] != version:
+        entry = (version, build())
+        with pipeline_cache_lock:
+            pipeline_cache[key] = entry
+
+    result = entry[1]
+    return None if result is None else result.copy(deep=False)
+
+# Empty the memoized results, so they are rebuilt on the next call
+def clear_pipeline_cache():
+    with pipeline_cache_lock:
+        pipeline_cache.clear()
+
+# Get the version of the cached master data
+def get_master_version():
+    return get_files_version([reads.master_cached_parquet_path, reads.master_cached_csv_path])
+
+# Get the version of the data used by get_master_current_time
+def get_current_time_version():
+    return get_master_version(), get_catalog_version(["Current"])
+
+# Get the version of the data used by get_master_cf_or_cv
+def get_cf_or_cv_version(cf_or_cv: typing.Literal["CF", "CV"]):
+    return get_master_version(), get_catalog_version([cf_or_cv])
+
+# Per-image features other than the RGB means, which are stored for both ages
+# as "<feature> Pristine" and "<feature> Exposed"
+image_detail_features = reads.image_feature_names[3:]
+
+# Gray level difference, out of 255, above which a pixel of the exposed
+# thumbnail has changed from the pristine one
+difference_threshold = 30
+
+# Columns generated by gen_dendrite_scores, in the order they are stored
+dendrite_score_columns = [
+    "Dendrite Score",
+    "R_PRISTINE", "G_PRISTINE", "B_PRISTINE",
+    "R_EXPOSED", "G_EXPOSED", "B_EXPOSED",
+    "Brightness Pristine", "Brightness Exposed"
+] + [f"{feature} {age}" for feature in image_detail_features for age in ["Pristine", "Exposed"]] + [
+    "Difference Mean", "Difference P95", "Difference Fraction"
+]
+
+# Get the mean RGB values, brightness, dendrite score, and the other image
+# features of the exposed image compared to the pristine image, for every row
+# of master. Each distinct image is decoded at most once, in a thread pool,
+# which runs in parallel because cv2 releases the GIL, and all features are
+# taken from that decode. The result has the same index as master, so it can
+# be assigned in one write.
+# workers is the thread count, where None uses the ThreadPoolExecutor default.
+# image_scale is the decode scale of the images, see reads.image_scale_flags
+def gen_dendrite_scores(master: pd.DataFrame, workers: typing.Optional[int] = None, image_scale: int = 1):
+
+    # Only rows with both images can be scored
+    has_images = master["Image_PRISTINE"].apply(lambda name: isinstance(name, str)) \
+        & master["Image_EXPOSED"].apply(lambda name: isinstance(name, str))
+
+    # Decode each distinct image once in the pool. This fills the reads cache,
+    # so pristine images shared by many rows are not decoded again
+    images = {(file_name, "PRISTINE") for file_name in master.loc[has_images, "Image_PRISTINE"]} \
+        | {(file_name, "EXPOSED") for file_name in master.loc[has_images, "Image_EXPOSED"]}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda image: reads.get_sensor_image_features(*image, image_scale), images))
+
+    # Get the features of both images of a row from the cache, or None if
+    # either can't be read
+    def read_row_features(pristine_name, exposed_name):
+        pristine_features = reads.get_sensor_image_features(pristine_name, "PRISTINE", image_scale)
+        exposed_features = reads.get_sensor_image_features(exposed_name, "EXPOSED", image_scale)
+        if pristine_features is None or exposed_features is None:
+            return None
+
+        return pristine_features, exposed_features
+
+    row_features = [
+        read_row_features(pristine_name, exposed_name) if has_image else None
+        for pristine_name, exposed_name, has_image
+        in zip(master["Image_PRISTINE"], master["Image_EXPOSED"], has_images)
+    ]
+
+    return get_dendrite_scores(master.index, row_features)
+
+# Get the features of every row of master straight from the board images,
+# instead of from the cropped sensor images, and score them as in
+# gen_dendrite_scores. Exposed boards are aligned to their pattern's template
+# first, so the thumbnail difference compares the same pixels. Pristine
+# features are matched on pattern and sensor, and exposed features on board ID
+# and sensor, like the image file names in get_master
+def gen_board_dendrite_scores(master: pd.DataFrame, workers: typing.Optional[int] = None):
+    features = generators.gen_sensor_image_features(workers=workers, align=True)
+
+    # Sample use: pristine_features[(pattern, sensor)] -> (features, thumbnail)
+    # If several boards share a key, the last one by board ID is kept, like the
+    # last file name in add_image_names
+    features = features.sort_values("Board ID", kind="stable")
+    pristine_features, exposed_features = {}, {}
+    for board_id, pattern, sensor, age, *image_features, thumbnail in features.itertuples(index=False):
+        if age == "PRISTINE":
+            pristine_features[(float(pattern), sensor)] = (tuple(image_features), thumbnail)
+        else:
+            exposed_features[(board_id, sensor)] = (tuple(image_features), thumbnail)
+
+    row_features = []
+    for board_id, pattern, sensor in zip(master["Board ID"], master["Pattern"], master["Sensor"]):
+        pristine = pristine_features.get((pattern, sensor))
+        exposed = exposed_features.get((board_id, sensor))
+        row_features.append(None if pristine is None or exposed is None else (pristine, exposed))
+
+    return get_dendrite_scores(master.index, row_features)
+
+# Get the dendrite_score_columns from a list with, for each row, the pristine
+# then exposed (features, thumbnail) of reads.get_image_features, or None for
+# rows without both images
+def get_dendrite_scores(index: pd.Index, row_features: list):
+    feature_count = len(reads.image_feature_names)
+    thumbnail_shape = (reads.image_thumbnail_size, reads.image_thumbnail_size)
+
+    # Rows (sensors) by features. NaN is used for rows whose images couldn't be
+    # read, because NaN is for numbers
+    pristine = np.full((len(index), feature_count), np.nan)
+    exposed = np.full((len(index), feature_count), np.nan)
+    pristine_thumbnails = np.zeros((len(index), *thumbnail_shape), dtype=np.uint8)
+    exposed_thumbnails = np.zeros((len(index), *thumbnail_shape), dtype=np.uint8)
+    for i, features in enumerate(row_features):
+        if features is not None:
+            (pristine[i], pristine_thumbnails[i]), (exposed[i], exposed_thumbnails[i]) = features
+
+    scores = pd.DataFrame(index=index)
+    scores["Dendrite Score"] = np.sqrt(((exposed[:, :3] - pristine[:, :3])**2).sum(axis=1))
+    scores[["R_PRISTINE", "G_PRISTINE", "B_PRISTINE"]] = pristine[:, :3]
+    scores[["R_EXPOSED", "G_EXPOSED", "B_EXPOSED"]] = exposed[:, :3]
+
+    # Brightness is the mean of the RGB values
+    scores["Brightness Pristine"] = pristine[:, :3].mean(axis=1)
+    scores["Brightness Exposed"] = exposed[:, :3].mean(axis=1)
+
+    for i, feature in enumerate(image_detail_features, start=3):
+        scores[f"{feature} Pristine"] = pristine[:, i]
+        scores[f"{feature} Exposed"] = exposed[:, i]
+
+    # Summarize the pixel differences of the aligned thumbnails of all rows at
+    # once, as rows by pixels
+    difference = np.abs(exposed_thumbnails.astype(np.int16) - pristine_thumbnails).reshape(len(index), -1)
+    has_features = np.array([features is not None for features in row_features], dtype=bool)
+    scores["Difference Mean"] = np.where(has_features, difference.mean(axis=1), np.nan)
+    scores["Difference P95"] = np.where(has_features, np.percentile(difference, 95, axis=1), np.nan)
+    scores["Difference Fraction"] = np.where(has_features, (difference > difference_threshold).mean(axis=1), np.nan)
+
+    return scores[dendrite_score_columns]
+
+# Add the Image_PRISTINE and Image_EXPOSED file names of the sensor images to
+# master, from the catalog, so each age only needs one keyed merge into master.
+# PRISTINE images are matched on pattern and sensor, and EXPOSED images on board
+# ID and sensor. If several files share a key, the last one by file name is kept
+def add_image_names(master: pd.DataFrame):
+    pristine_files = catalog.get_catalog_files("Sensor Image", "PRISTINE").sort_values("File Name")
+    pristine_names = pd.DataFrame({"Pattern": pristine_files["Pattern"].astype(float).to_numpy(),
+                                   "Sensor": pristine_files["Sensor"].astype(str).to_numpy(),
+                                   "Image_PRISTINE": pristine_files["File Name"].to_numpy()})
+    pristine_names.drop_duplicates(subset=["Pattern", "Sensor"], keep="last", inplace=True)
+
+    exposed_files = catalog.get_catalog_files("Sensor Image", "EXPOSED").sort_values("File Name")
+    exposed_names = pd.DataFrame({"Board ID": exposed_files["Board ID"].to_numpy(),
+                                  "Sensor": exposed_files["Sensor"].astype(str).to_numpy(),
+                                  "Image_EXPOSED": exposed_files["File Name"].to_numpy()})
+    exposed_names.drop_duplicates(subset=["Board ID", "Sensor"], keep="last", inplace=True)
+
+    master = master.merge(pristine_names, on=["Pattern", "Sensor"], how="left")
+    return master.merge(exposed_names, on=["Board ID", "Sensor"], how="left")
+
+# Get the cleaned master data. workers is passed to gen_dendrite_scores when
+# the data is not read from cache. With from_boards, the image means are
+# computed straight from the board images, so the cropped sensor images aren't
+# needed. Otherwise image_scale is passed to gen_dendrite_scores
+def get_master(from_cache=True, workers: typing.Optional[int] = None, from_boards=False, image_scale: int = 1):
     # If cached version is requested, read and return cached version
     # updated version to prevent nothing from being returned
     if from_cache:
-        cached=reads.get_master_cached()
+        cached=memoize(("master",), get_master_version(), reads.get_master_cached)
         if cached is not None:
             return cached
 
@@ -23,166 +233,495 @@ def get_master(from_cache=True):
     master = reads.get_master()
     
     # Add image file names
-    for file_name in os.listdir("../Imgscans_PRISTINE_sensors"):
-        # Get components
-        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
-        pattern = int(pattern)
-        # Mask only where pattern and sensor match
-        mask = (master["Pattern"] == pattern) & (master["Sensor"] == sensor)
-        # Store the file name using the mask
-        master.loc[mask, "Image_PRISTINE"] = file_name
-
-    for file_name in os.listdir("../Imgscans_EXPOSED_sensors"):
-        # Get components
-        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
-        board_id = "_".join([batch, pattern, id])
-        # Mask only where board ID and sensor match
-        mask = (master["Board ID"] == board_id) & (master["Sensor"] == sensor)
-        # Store the file name using the mask
-        master.loc[mask, "Image_EXPOSED"] = file_name
-    # TODO Remove CV, CF, and CurrentTime file names from the stored CSV. Add
-    # code here to populate those columns automatically
-
-    # Get dendrite score of the exposed file, compared to the pristine
-    def gen_dendrite_score(master_index, master_row):
-        # Read images
-        pristine_image = reads.get_sensor_image(master_row["Image_PRISTINE"], "PRISTINE")
-        exposed_image = reads.get_sensor_image(master_row["Image_EXPOSED"], "EXPOSED")
-
-        # Return NaN if images couldn't be read
-        if pristine_image is None or exposed_image is None:
-            # NaN is used instead of None because NaN is for numbers, None
-            # is for objects
-            return np.nan
-
-        # Reorder from BGR to RGB
-        pristine_image = cv2.cvtColor(pristine_image, cv2.COLOR_BGR2RGB)
-        exposed_image = cv2.cvtColor(exposed_image, cv2.COLOR_BGR2RGB)
-
-        # Split into RGB components
-        r1, g1, b1 = cv2.split(pristine_image)
-        r2, g2, b2 = cv2.split(exposed_image)
-
-        # Convert rgb arrays into mean values
-        r1, g1, b1 = np.mean(r1), np.mean(g1), np.mean(b1)
-        r2, g2, b2 = np.mean(r2), np.mean(g2), np.mean(b2)
-
-        # Generate and store score
-        master.loc[master_index, "Dendrite Score"] = math.sqrt((r2 - r1)**2 + (g2 - g1)**2 + (b2 - b1)**2)
-
-        # Store RGB values
-        master.loc[master_index, "R_PRISTINE"] = r1
-        master.loc[master_index, "G_PRISTINE"] = g1
-        master.loc[master_index, "B_PRISTINE"] = b1
-        master.loc[master_index, "R_EXPOSED"] = r2
-        master.loc[master_index, "G_EXPOSED"] = g2
-        master.loc[master_index, "B_EXPOSED"] = b2
-
-        # Get brightness values for pristine and exposed images using the mean
-        # of the RGB values and store in their own columns
-        pristine_brightness=np.mean([r1, g1, b1])
-        exposed_brightness=np.mean([r2, g2, b2])
-        master.loc[master_index, "Brightness Pristine"]=pristine_brightness
-        master.loc[master_index, "Brightness Exposed"]=exposed_brightness
-
-
-    # Populate mean RGB and dendrite score
-    for i, row in master.iterrows():
-        gen_dendrite_score(i, row)
+    master = add_image_names(master)
+
+    # Populate the CF, CV and CurrentTime file names from the catalog. The names
+    # stored in the masterlist are replaced, so a misspelled or missing name
+    # doesn't drop a sensor's measurements
+    master = populate_measurement_files(master)
+
+    # Populate mean RGB, brightness, and dendrite score in one column-wise write.
+    # The persistent image means store is loaded first, so only new or changed
+    # images are decoded, and it is saved with those images afterwards
+    if from_boards:
+        scores = gen_board_dendrite_scores(master, workers=workers)
+    else:
+        reads.load_image_features_store()
+        scores = gen_dendrite_scores(master, workers=workers, image_scale=image_scale)
+        reads.save_image_features_store()
+    master[scores.columns] = scores
+
+    # Detect failures from the CurrentTime traces, joined on the file name
+    traces = reads.get_current_time_all(master["Current"].dropna().unique().tolist(), workers=workers)
+    master = master.join(failures.detect_failures(traces), on="Current")
+
+    # Add the baseline vs post CF and CV features
+    for cf_or_cv in ["CF", "CV"]:
+        features = gen_cf_or_cv_delta_features(master, cf_or_cv)
+        master[features.columns] = features
+
+    return master
 
+# Master columns derived from the sensor images, see add_image_names and
+# gen_dendrite_scores
+image_columns = ["Image_PRISTINE", "Image_EXPOSED"] + dendrite_score_columns
+
+# Keep the values of cached, the previously cached master, that a rebuild of
+# master can't produce from the files on disk. Rows whose sensor images aren't
+# on disk get no dendrite score, so their image columns are filled from cached,
+# and columns of cached that the rebuild doesn't produce are carried over. Rows
+# are matched on board ID, sensor, and their order among the rows sharing those
+def keep_cached_values(master: pd.DataFrame, cached: typing.Optional[pd.DataFrame]):
+    if cached is None:
+        return master
+
+    def get_keys(df: pd.DataFrame):
+        keys = df[["Board ID", "Sensor"]].astype(str)
+        return keys.assign(Occurrence=keys.groupby(["Board ID", "Sensor"]).cumcount())
+
+    positions = get_keys(master).merge(get_keys(cached).assign(Position=np.arange(len(cached))),
+                                       on=["Board ID", "Sensor", "Occurrence"], how="left")["Position"]
+    cached = cached.reset_index(drop=True).reindex(positions.fillna(-1).astype(int).to_numpy())
+    cached.index = master.index
+
+    master = master.copy()
+    unscored = master["Dendrite Score"].isna()
+    for column in cached.columns:
+        if column not in master.columns:
+            master[column] = cached[column]
+        elif column in image_columns:
+            master.loc[unscored, column] = master.loc[unscored, column].fillna(cached.loc[unscored, column])
 
     return master
 
-# Get a DataFrame that is the merging of the master data and all the
-# CurrentTime files. Each row represents one current measurement at a given
-# time, and it has data about the sensor, solution, etc.
-def get_master_current_time():
+# Columns of the frame returned by get_master_rgb
+master_rgb_columns = ["Board ID", "Sensor", "Pattern", "Solution", "Age", "R", "G", "B"]
+
+# Get the mean RGB values of every sensor image in long form, with one row per
+# master row and age, and R, G and B columns. Rows without either image are
+# dropped. It's memoized with the cached master, see get_master_rgb
+def get_master_rgb():
+    return memoize(("master_rgb",), get_master_version(), build_master_rgb)
+
+# Build the frame of get_master_rgb by stacking the PRISTINE and EXPOSED column
+# blocks of master, so no reshaping or aggregation is needed
+def build_master_rgb():
     master = get_master()
 
-    current_time_all = [] # List of all currentTime data frames
+    ids = ["Board ID", "Sensor", "Pattern", "Solution"]
+    blocks = []
+    for age in ["PRISTINE", "EXPOSED"]:
+        block = master[ids + [f"R_{age}", f"G_{age}", f"B_{age}"]]
+        block.columns = ids + ["R", "G", "B"]
+        blocks.append(block.assign(Age=age))
+
+    rgb = pd.concat(blocks, ignore_index=True).dropna(subset=["R", "G", "B"], how="all")
+    rgb["Age"] = rgb["Age"].astype(pd.CategoricalDtype(["PRISTINE", "EXPOSED"]))
+
+    return rgb[master_rgb_columns].reset_index(drop=True)
+
+# Master columns naming measurement files, and the kind and age of their files.
+# CurrentTime files have no age
+measurement_file_columns = {
+    "CF_Baseline": ("CF", "PRISTINE"), "CF_Post": ("CF", "EXPOSED"),
+    "CV_Baseline": ("CV", "PRISTINE"), "CV_Post": ("CV", "EXPOSED"),
+    "Current": ("Current", None)
+}
+
+# Statuses of match_measurement_files. Missing is a master row and column with
+# no file, Orphan a file with no master row, and Unparsed a file whose name
+# doesn't follow the naming convention, so it can't be matched
+measurement_statuses = pd.CategoricalDtype(["Matched", "Missing", "Orphan", "Unparsed"])
+
+# Match the rows of master with the measurement files of the catalog, on board
+# ID, sensor, and the column a file belongs in (see measurement_file_columns).
+# Every master row and column, and every file, is matched in one outer merge.
+# Returns one row per match, with the columns Row (the position of the master
+# row), Column, Board ID, Sensor, File Name, Date, Iteration and Status
+def match_measurement_files(master: pd.DataFrame):
+    files = catalog.get_catalog()
+
+    # The master column of each file, by its kind and age
+    columns = pd.Series(np.nan, index=files.index, dtype="object")
+    for column, (kind, age) in measurement_file_columns.items():
+        is_age = files["Age"].isna() if age is None else files["Age"] == age
+        columns[(files["Kind"] == kind) & is_age] = column
+    files = files.assign(Column=columns).dropna(subset="Column")
+    files = files.astype({"Sensor": "object"})[["Column", "Board ID", "Sensor", "File Name", "Date", "Iteration",
+                                                "Parsed"]]
+
+    # Every master row once per column
+    keys = pd.DataFrame({
+        "Row": np.tile(np.arange(len(master)), len(measurement_file_columns)),
+        "Column": np.repeat(list(measurement_file_columns), len(master)),
+        "Board ID": np.tile(master["Board ID"].to_numpy(dtype="object"), len(measurement_file_columns)),
+        "Sensor": np.tile(master["Sensor"].to_numpy(dtype="object"), len(measurement_file_columns))
+    })
+
+    # Unparsed files have no board ID or sensor, so they're left out of the
+    # merge, which would match their missing keys with each other
+    parsed = files[files["Parsed"]].drop(columns="Parsed")
+    matches = keys.merge(parsed, on=["Column", "Board ID", "Sensor"], how="outer", indicator=True)
+    matches["Status"] = matches.pop("_merge").map(
+        {"both": "Matched", "left_only": "Missing", "right_only": "Orphan"}).astype("object")
+
+    unparsed = files[~files["Parsed"]].drop(columns="Parsed").assign(Status="Unparsed")
+    matches = pd.concat([matches, unparsed], ignore_index=True)
+    matches["Row"] = matches["Row"].astype("Int64")
+    matches["Status"] = matches["Status"].astype(measurement_statuses)
+
+    return matches[["Row", "Column", "Board ID", "Sensor", "File Name", "Date", "Iteration", "Status"]]
+
+# Get the measurement files of the rows of master, see match_measurement_files.
+# When a master row has several files for a column, iterations="latest" keeps
+# only the latest by date then iteration, and iterations="all" keeps them all
+def get_measurement_files(master: pd.DataFrame, iterations: typing.Literal["latest", "all"] = "latest"):
+    matches = match_measurement_files(master)
+    files = matches[matches["Status"] == "Matched"].drop(columns="Status")
+    files = files.sort_values(["Row", "Column", "Date", "Iteration", "File Name"], ignore_index=True)
+
+    if iterations == "latest":
+        files = files.drop_duplicates(subset=["Row", "Column"], keep="last", ignore_index=True)
+
+    files["Row"] = files["Row"].astype("int64")
+    return files
+
+# Get the report of master rows and columns missing a measurement file, and
+# measurement files that are orphaned or unparsed, see match_measurement_files
+def get_measurement_report(master: pd.DataFrame):
+    matches = match_measurement_files(master)
+    return matches[matches["Status"] != "Matched"].reset_index(drop=True)
+
+# Master column that the numeric readings stored in the Current column, such
+# as 0.0054, are moved to by populate_measurement_files
+current_reading_column = "Current Reading"
+
+# Fill the measurement file columns of master with the latest file of each row
+# from the catalog, in place of the names stored in the masterlist. Only cells
+# that are NaN or hold a file name are filled, and cells with no file in the
+# catalog keep their stored name. Cells holding a number are readings, not file
+# names, so they're moved to current_reading_column for Current, and left as
+# they are for the other columns
+def populate_measurement_files(master: pd.DataFrame):
+    files = get_measurement_files(master, iterations="latest")
+
+    for column in measurement_file_columns:
+        readings = pd.to_numeric(master[column], errors="coerce")
+        is_reading = readings.notna().to_numpy()
+
+        column_files = files[files["Column"] == column]
+        rows = column_files["Row"].to_numpy()
+        names = master[column].to_numpy(dtype="object").copy()
+        names[rows] = np.where(is_reading[rows], names[rows], column_files["File Name"].to_numpy())
+
+        if column == "Current":
+            master[current_reading_column] = readings
+            names[is_reading] = np.nan
+        master[column] = names
 
-    # For each row, read the currentTime file if possible, and append it to list
-    for _, row in master.iterrows():
-        # Get the current_in value, which could be a float or file name
-        current_in = row["Current"]
+    return master
 
-        # Read file, and skip if result is None
-        current_time = reads.get_current_time(current_in)
-        if current_time is None:
+# Build the index of the measurement files of a kind named in master, with one
+# row per file name and master row, and the columns File Name, Row (the
+# position of the master row), Kind and Age. Rows without a file name are left
+# out
+def build_file_index(master: pd.DataFrame, kind: typing.Literal["CF", "CV", "Current"]):
+    frames = []
+    for column, (column_kind, age) in measurement_file_columns.items():
+        if column_kind != kind:
             continue
 
-        # Add file_name column for joining purposes
-        current_time["File Name"] = current_in
+        has_file = master[column].notna().to_numpy()
+        frames.append(pd.DataFrame({
+            "File Name": master[column].to_numpy()[has_file].astype(str),
+            "Row": np.flatnonzero(has_file),
+            "Kind": kind,
+            "Age": age
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+# Join master with measurements, a frame with a "File Name" column and one or
+# more rows per file, through the file index of the given kind built from
+# master's file name columns, see build_file_index. Only the master columns in
+# columns are copied onto the measurements, or all of them if None. The file
+# names are turned into integer codes, and each index entry takes its master row
+# and the block of rows of its file by position, so nothing is merged on
+# strings. An "Age" column is added for CF and CV. The result has the master
+# columns, then the measurement columns, in index then measurement order
+def join_file_index(master: pd.DataFrame, kind: typing.Literal["CF", "CV", "Current"],
+                    measurements: pd.DataFrame, columns: typing.Optional[list] = None):
+    entries = build_file_index(master, kind)
+    if columns is not None:
+        master = master[columns]
+
+    # Codes of the measured files, and the block of sorted rows of each file
+    file_codes, file_names = pd.factorize(measurements["File Name"].astype(str))
+    order = np.argsort(file_codes, kind="stable")
+    counts = np.bincount(file_codes, minlength=len(file_names))
+    starts = np.cumsum(counts) - counts
+
+    # Entries whose file has measurements
+    entry_codes = pd.Index(file_names).get_indexer(entries["File Name"])
+    entries = entries[entry_codes >= 0]
+    entry_codes = entry_codes[entry_codes >= 0]
+
+    # Repeat each entry once per row of its file, and take those rows in order
+    entry_counts = counts[entry_codes]
+    repeats = np.repeat(np.arange(len(entries)), entry_counts)
+    offsets = np.arange(len(repeats)) - np.repeat(np.cumsum(entry_counts) - entry_counts, entry_counts)
+    positions = order[starts[entry_codes][repeats] + offsets]
+
+    joined = master.take(entries["Row"].to_numpy()[repeats]).reset_index(drop=True)
+    measured = measurements.drop(columns="File Name").take(positions).reset_index(drop=True)
+    joined = pd.concat([joined, measured], axis=1)
+
+    if kind != "Current":
+        joined["Age"] = entries["Age"].to_numpy()[repeats]
+
+    return joined
+
+# Decimate traces for plotting. Each trace is split into equal-width buckets of
+# x, and only the samples with the minimum and maximum y of each bucket are
+# kept, along with the first and last sample. This keeps the visual shape of
+# each trace, including spikes, while drawing at most about 2 * buckets + 2
+# points per trace. All traces are decimated at once, with no loop over traces
+def decimate_traces(traces: pd.DataFrame, trace_column: str, x: str, y: str, buckets: int):
+    traces = traces.sort_values([trace_column, x], ignore_index=True)
+
+    # Get the bucket of each sample, relative to the x range of its trace
+    x_group = traces.groupby(trace_column, observed=True)[x]
+    x_min = x_group.transform("min")
+    x_span = (x_group.transform("max") - x_min).replace(0, 1)
+    bucket = ((traces[x] - x_min) / x_span * buckets).astype("int64").clip(upper=buckets - 1)
+
+    y_group = traces[y].groupby([traces[trace_column], bucket], observed=True)
+    keep = np.unique(np.concatenate([
+        y_group.idxmin().to_numpy(), y_group.idxmax().to_numpy(),
+        x_group.idxmin().to_numpy(), x_group.idxmax().to_numpy()
+    ]))
+
+    return traces.loc[keep].reset_index(drop=True)
 
-        # Append this current_time to current_time_all
-        current_time_all.append(current_time)
-
-    # Convert current_time_all, (a list), to a concatenation of all its contents
-    current_time_all = pd.concat(current_time_all)
+# Get a DataFrame that is the merging of the master data and all the
+# CurrentTime files. Each row represents one current measurement at a given
+# time, and it has data about the sensor, solution, etc. Only the given master
+# columns are joined onto the samples, or all of them if columns is None. If
+# buckets is given, each trace is decimated to that many buckets of time, see
+# decimate_traces. Results are memoized until master or the CurrentTime files
+# change
+def get_master_current_time(columns: typing.Optional[list] = None, buckets: typing.Optional[int] = None):
+    key = ("current_time", None if columns is None else tuple(columns), buckets)
+
+    return memoize(key, get_current_time_version(), lambda: join_master_current_time(columns, buckets))
+
+# Join master with the CurrentTime traces. See get_master_current_time
+def join_master_current_time(columns: typing.Optional[list] = None, buckets: typing.Optional[int] = None):
+    master = get_master()
 
-    # Join master with current_time_all
-    master_current_time = master.merge(
-        current_time_all,
-        left_on="Current", right_on="File Name",
-        how="inner"
-    )
+    # Read the traces of every file named in master from the CurrentTime store
+    current_time_all = reads.get_current_time_all(master["Current"].dropna().unique())
 
-    # The file names are no longer needed
-    master_current_time.drop(columns=["File Name", "Current"], inplace=True)
+    # Decimate before joining, so fewer samples are joined
+    if buckets is not None:
+        current_time_all = decimate_traces(current_time_all, "File Name", "Time (ms)", "Current (mA)", buckets)
 
-    return master_current_time
+    # Join master with current_time_all through the file index. Only the
+    # requested columns are copied onto every sample, and the file names are
+    # no longer needed
+    columns = [column for column in (master.columns if columns is None else columns) if column != "Current"]
+    return join_file_index(master, "Current", current_time_all, columns)
 
 # Returns the master merged with all CF files, or all CV files. An "Age" column
-# is added to differentiate "PRISTINE" vs "EXPOSED"
+# is added to differentiate "PRISTINE" vs "EXPOSED". Results are memoized until
+# master or the CF/CV files change
 def get_master_cf_or_cv(cf_or_cv: typing.Literal["CF", "CV"]):
-    master = get_master()
+    return memoize(("cf_or_cv", cf_or_cv), get_cf_or_cv_version(cf_or_cv), lambda: join_master_cf_or_cv(cf_or_cv))
 
-    df_all = [] # List of all DataFrames, either cf or cv, has an Age column
+# Join master with the CF or CV sweeps. See get_master_cf_or_cv
+def join_master_cf_or_cv(cf_or_cv: typing.Literal["CF", "CV"]):
+    master = get_master()
 
-    # Populate df_all with both ages
-    for age in ["PRISTINE", "EXPOSED"]:
-        # For each row, read file, and append to list
-        for _, row in master.iterrows():
-            # Get file name
-            baseline_or_post = "Baseline" if age == "PRISTINE" else "Post"
-            file_name = row[f"{cf_or_cv}_{baseline_or_post}"]
-            
-            # Read df, skipping if result is None
-            df = reads.get_cf_or_cv(file_name)
-            if df is None:
-                continue
-            
-            # Add Age column to differentiate PRISTINE and EXPOSED
-            df["Age"] = age
-
-            # Add File Name column for joining purposes
-            df["File Name"] = file_name
-
-            # Append this DataFrame to list
-            df_all.append(df)
-
-    # Convert lists to a concatenation of all their contents
-    df_all = pd.concat(df_all, ignore_index=True)
-    
-    # Join master with baseline files
-    master_pristine = master.merge(
-        df_all,
-        left_on=f"{cf_or_cv}_Baseline",
-        right_on="File Name",
-        how="inner"
-    )
-    # Join master with post files
-    master_exposed = master.merge(
-        df_all,
-        left_on=f"{cf_or_cv}_Post",
-        right_on="File Name",
-        how="inner"
-    )
-
-    # Concat both merges into the result
-    master_cf_or_cv = pd.concat([master_pristine, master_exposed])
-
-    # The file names are no longer needed
-    master_cf_or_cv.drop(columns=["File Name", f"{cf_or_cv}_Baseline", f"{cf_or_cv}_Post"], inplace=True)
-
-    return master_cf_or_cv
+    # Read all sweeps of this kind from the sweep store in one read
+    sweep_axis = reads.sweep_axis_columns[cf_or_cv]
+    df_all = reads.get_cf_or_cv_all(cf_or_cv, columns=["File Name", "Sweep"] + reads.sweep_value_columns)
+    df_all.rename(columns={"Sweep": sweep_axis}, inplace=True)
+
+    # Join master with the baseline and post files through the file index. Age
+    # differentiates PRISTINE (baseline) and EXPOSED (post). The file names are
+    # no longer needed
+    file_columns = [f"{cf_or_cv}_Baseline", f"{cf_or_cv}_Post"]
+    columns = [column for column in master.columns if column not in file_columns]
+    return join_file_index(master, cf_or_cv, df_all, columns)
+
+# Capacitance range of good sweep rows. Rows outside it are bad data, and are
+# left out of the CF/CV cubes and deltas
+cube_capacitance_range = (0, 100)
+
+# Group columns of the CF/CV cubes, and the statistics stored for each value
+# column, as "<value column> <statistic>"
+cube_keys = ["Sensor", "Pattern", "Solution", "Age", "Sweep"]
+cube_statistics = ["Mean", "Std", "Count", "Min", "Max"]
+
+# Paths of the materialized CF and CV cubes, stored next to master_cached.csv
+cube_paths = {cf_or_cv: os.path.join(reads.IDC_directory, f"{cf_or_cv}_cube.parquet") for cf_or_cv in ["CF", "CV"]}
+
+# Build the CF or CV cube. The sweeps are aggregated per cube_keys, where Sweep
+# is the frequency or voltage, into the cube_statistics of each value column.
+# The cube is a few thousand rows, and any filter of its keys can be answered
+# from it by query_cf_or_cv_cube, without reading the sweeps
+def build_cf_or_cv_cube(cf_or_cv: typing.Literal["CF", "CV"]):
+    master = get_master()
+    sweeps = reads.get_cf_or_cv_all(cf_or_cv, columns=["File Name", "Sweep"] + reads.sweep_value_columns)
+
+    low, high = cube_capacitance_range
+    sweeps = sweeps[(sweeps["Capacitance (F)"] > low) & (sweeps["Capacitance (F)"] < high)]
+
+    sweeps = join_file_index(master, cf_or_cv, sweeps, ["Sensor", "Pattern", "Solution"])
+
+    groups = sweeps.groupby(cube_keys, observed=True, dropna=False)[reads.sweep_value_columns]
+    cube = groups.agg(["mean", "std", "count", "min", "max"])
+    cube.columns = [f"{column} {statistic}" for column, statistic in
+                    pd.MultiIndex.from_product([reads.sweep_value_columns, cube_statistics])]
+
+    return cube.reset_index()
+
+# Build the CF or CV cube and write it to its cube_paths file. This is done at
+# ingest time by update_cache.py
+def update_cf_or_cv_cube(cf_or_cv: typing.Literal["CF", "CV"]):
+    build_cf_or_cv_cube(cf_or_cv).to_parquet(cube_paths[cf_or_cv], index=False)
+
+# Get the version of the materialized CF or CV cube
+def get_cf_or_cv_cube_version(cf_or_cv: typing.Literal["CF", "CV"]):
+    return get_files_version([cube_paths[cf_or_cv]])
+
+# Get the materialized CF or CV cube, see build_cf_or_cv_cube. It's built if it
+# doesn't exist yet, and is otherwise rebuilt with the cached master by
+# update_cache.py
+def get_cf_or_cv_cube(cf_or_cv: typing.Literal["CF", "CV"]):
+    if not os.path.isfile(cube_paths[cf_or_cv]):
+        update_cf_or_cv_cube(cf_or_cv)
+
+    return memoize(("cube", cf_or_cv), get_cf_or_cv_cube_version(cf_or_cv),
+                   lambda: pd.read_parquet(cube_paths[cf_or_cv]))
+
+# Get the statistics of the CF or CV sweeps per by and sweep point, over the
+# cube rows matching filters, which maps cube keys to a value or list of
+# values. The statistics of the matching cube rows are combined: counts add,
+# means are weighted by count, and standard deviations are pooled from the
+# spread within and between rows. The sweep point column is named after the
+# sweep axis, such as "Frequency (Hz)"
+def query_cf_or_cv_cube(cf_or_cv: typing.Literal["CF", "CV"], by: typing.Optional[list] = None,
+                        filters: typing.Optional[dict] = None):
+    by = ["Sensor"] if by is None else list(by)
+    cube = get_cf_or_cv_cube(cf_or_cv)
+
+    for column, values in (filters or {}).items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        cube = cube[cube[column].isin(values)]
+
+    # Sums that combine across rows, per value column
+    sums = pd.DataFrame({column: cube[column] for column in by + ["Sweep"]})
+    for column in reads.sweep_value_columns:
+        count = cube[f"{column} Count"]
+        mean = cube[f"{column} Mean"]
+        variance = cube[f"{column} Std"].fillna(0)**2
+        sums[f"{column} Count"] = count
+        sums[f"{column} Sum"] = count * mean
+        sums[f"{column} Square Sum"] = (count - 1) * variance + count * mean**2
+        sums[f"{column} Min"] = cube[f"{column} Min"]
+        sums[f"{column} Max"] = cube[f"{column} Max"]
+
+    groups = sums.groupby(by + ["Sweep"], observed=True)
+    totals = groups.sum(numeric_only=True)
+    extremes = groups.agg({f"{column} {statistic}": statistic.lower() for column in reads.sweep_value_columns
+                           for statistic in ["Min", "Max"]})
+
+    result = pd.DataFrame(index=totals.index)
+    for column in reads.sweep_value_columns:
+        count = totals[f"{column} Count"]
+        mean = totals[f"{column} Sum"] / count
+        variance = (totals[f"{column} Square Sum"] - count * mean**2) / (count - 1)
+        result[f"{column} Mean"] = mean
+        result[f"{column} Std"] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        result[f"{column} Count"] = count
+        result[f"{column} Min"] = extremes[f"{column} Min"]
+        result[f"{column} Max"] = extremes[f"{column} Max"]
+
+    return result.reset_index().rename(columns={"Sweep": reads.sweep_axis_columns[cf_or_cv]})
+
+# Get every CF or CV sweep in the sweep store as arrays of files by sweep points.
+# The sweep points of all files are put on one grid, with NaN where a file has
+# no value or the row is bad data, see cube_capacitance_range. Returns the file
+# names in row order, the grid, and a dict of value column to array
+def get_cf_or_cv_arrays(cf_or_cv: typing.Literal["CF", "CV"]):
+    sweeps = reads.get_cf_or_cv_all(cf_or_cv, columns=["File Name", "Sweep"] + reads.sweep_value_columns)
+
+    low, high = cube_capacitance_range
+    good = (sweeps["Capacitance (F)"] > low) & (sweeps["Capacitance (F)"] < high)
+    sweeps.loc[~good, reads.sweep_value_columns] = np.nan
+
+    # Round the sweep points, so points written with float error line up
+    grid, point_indices = np.unique(sweeps["Sweep"].round(6).to_numpy(), return_inverse=True)
+    file_indices, file_names = pd.factorize(sweeps["File Name"].astype(str))
+
+    arrays = {}
+    for column in reads.sweep_value_columns:
+        arrays[column] = np.full((len(file_names), len(grid)), np.nan)
+        arrays[column][file_indices, point_indices] = sweeps[column].to_numpy()
+
+    return list(file_names), grid, arrays
+
+# Get the PRISTINE and EXPOSED sweeps of every row of master lined up on the
+# sweep grid of get_cf_or_cv_arrays, and their difference, post minus
+# baseline. Returns the grid and a dict of value column to a dict of
+# "Baseline", "Post" and "Delta" arrays of rows (sensors) by sweep points. Rows
+# without both sweeps, and points missing from either, are NaN
+def get_cf_or_cv_delta_arrays(master: pd.DataFrame, cf_or_cv: typing.Literal["CF", "CV"]):
+    file_names, grid, arrays = get_cf_or_cv_arrays(cf_or_cv)
+
+    # Array rows of the baseline and post file of each master row, -1 if none
+    files = pd.Index(file_names)
+    baseline_rows = files.get_indexer(master[f"{cf_or_cv}_Baseline"])
+    post_rows = files.get_indexer(master[f"{cf_or_cv}_Post"])
+    has_both = (baseline_rows >= 0) & (post_rows >= 0)
+
+    deltas = {}
+    for column, array in arrays.items():
+        baseline = np.where(has_both[:, None], array[baseline_rows], np.nan)
+        post = np.where(has_both[:, None], array[post_rows], np.nan)
+        deltas[column] = {"Baseline": baseline, "Post": post, "Delta": post - baseline}
+
+    return grid, deltas
+
+# Sweep point that the capacitance drift is taken at, 1 kHz for CF and 0 V for CV
+delta_reference_points = {"CF": 1000, "CV": 0}
+
+# Get features of the change of each row of master from its PRISTINE to its
+# EXPOSED CF or CV sweep, computed for all rows at once from
+# get_cf_or_cv_delta_arrays. The columns, prefixed with CF or CV, are:
+# - Capacitance Drift: the relative change in capacitance at the
+#   delta_reference_points sweep point
+# - Mean Capacitance Delta (F): the mean change in capacitance over the sweep
+# - Impedance Collapse Ratio: the smallest post to baseline impedance ratio over
+#   the sweep, where a dendrite short gives a value near 0
+# - Max Phase Delta (D): the largest change in phase angle over the sweep
+# Rows without both sweeps are NaN
+def gen_cf_or_cv_delta_features(master: pd.DataFrame, cf_or_cv: typing.Literal["CF", "CV"]):
+    grid, deltas = get_cf_or_cv_delta_arrays(master, cf_or_cv)
+    capacitance, impedance, phase = (deltas[column] for column in reads.sweep_value_columns)
+
+    reference = np.argmin(np.abs(grid - delta_reference_points[cf_or_cv])) if len(grid) else 0
+
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        # Rows that are all NaN give NaN, which is expected
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+        features = pd.DataFrame(index=master.index)
+        features[f"{cf_or_cv} Capacitance Drift"] = \
+            capacitance["Delta"][:, reference] / capacitance["Baseline"][:, reference]
+        features[f"{cf_or_cv} Mean Capacitance Delta (F)"] = np.nanmean(capacitance["Delta"], axis=1)
+        features[f"{cf_or_cv} Impedance Collapse Ratio"] = np.nanmin(impedance["Post"] / impedance["Baseline"], axis=1)
+        features[f"{cf_or_cv} Max Phase Delta (D)"] = np.nanmax(np.abs(phase["Delta"]), axis=1)
+
+    return features
@@ -0,0 +1,82 @@
+# Benchmarks for parts of the pipeline. These are run by hand to compare the
+# speed of alternative implementations, and are not used by the pipeline.
+
+import reads
+import adds
+import failures
+import pandas as pd
+import cv2
+import time
+import os
+
+# Get the best time of several runs of a function, in seconds
+def time_best(function, repeats=10):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+# Compare loading the cached master from Parquet against the CSV paths
+def benchmark_master_cached(repeats=20):
+    csv_time = time_best(lambda: pd.read_csv(reads.master_cached_csv_path), repeats)
+    csv_typed_time = time_best(
+        lambda: reads.cast_master_types(pd.read_csv(reads.master_cached_csv_path)), repeats)
+    parquet_time = time_best(lambda: pd.read_parquet(reads.master_cached_parquet_path), repeats)
+
+    print(f"Cached master load time (best of {repeats})")
+    print(f"  CSV:             {csv_time * 1000:8.2f} ms")
+    print(f"  CSV with types:  {csv_typed_time * 1000:8.2f} ms")
+    print(f"  Parquet:         {parquet_time * 1000:8.2f} ms ({csv_typed_time / parquet_time:.1f}x faster)")
+
+# Time failure detection over every CurrentTime trace in the store
+def benchmark_failure_detection(repeats=10):
+    traces = reads.get_current_time_all()
+    detect_time = time_best(lambda: failures.detect_failures(traces), repeats)
+
+    print(f"Failure detection time (best of {repeats})")
+    print(f"  {traces['File Name'].nunique()} traces, {len(traces)} samples: {detect_time * 1000:8.2f} ms")
+
+# Compare computing the dendrite scores with the sensor images decoded at each
+# scale of reads.image_scale_flags. The time of the decode alone, and of the
+# decode with the feature extraction of reads.read_image_features, are compared
+# with the full scale, as is the largest error of the RGB means and dendrite
+# scores, where tolerance is the largest acceptable error out of 255
+def benchmark_image_scales(repeats=3, tolerance=0.5):
+    master = adds.get_master()
+    images = [(file_name, age) for age in ["PRISTINE", "EXPOSED"]
+              for file_name in master[f"Image_{age}"].dropna().unique()]
+    paths = [reads.get_sensor_image_path(file_name, age) for file_name, age in images]
+    paths = [path for path in paths if os.path.isfile(path)]
+
+    rgb_columns = ["R_PRISTINE", "G_PRISTINE", "B_PRISTINE", "R_EXPOSED", "G_EXPOSED", "B_EXPOSED"]
+    full_decode_time, full_features_time, full_scores = None, None, None
+
+    print(f"Sensor image decode time, decode and features time (best of {repeats}, {len(paths)} images), "
+          f"and error against full scale")
+    for scale in reads.image_scale_flags:
+        decode_time = time_best(lambda: [cv2.imread(path, reads.image_scale_flags[scale]) for path in paths], repeats)
+        features_time = time_best(lambda: [reads.read_image_features(path, scale) for path in paths], repeats)
+
+        # Score without the image means cache, so every image is decoded
+        reads.clear_image_features_cache()
+        scores = adds.gen_dendrite_scores(master, image_scale=scale)
+        if scale == 1:
+            full_decode_time, full_features_time, full_scores = decode_time, features_time, scores
+
+        rgb_error = (scores[rgb_columns] - full_scores[rgb_columns]).abs().max().max()
+        score_error = (scores["Dendrite Score"] - full_scores["Dendrite Score"]).abs().max()
+        within = "yes" if max(rgb_error, score_error) <= tolerance else "no"
+        print(f"  1/{scale}: decode {decode_time * 1000:8.1f} ms ({full_decode_time / decode_time:4.1f}x faster), "
+              f"decode and features {features_time * 1000:8.1f} ms "
+              f"({full_features_time / features_time:4.1f}x faster), "
+              f"max RGB error {rgb_error:.3f}, max score error {score_error:.3f}, within {tolerance}: {within}")
+
+    reads.clear_image_features_cache()
+
+if __name__ == "__main__":
+    benchmark_master_cached()
+    benchmark_failure_detection()
+    benchmark_image_scales()
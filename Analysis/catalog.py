@@ -0,0 +1,199 @@
+# Catalog of the data files. The CF, CV, CurrentTime and Imgscans_* directories
+# are scanned once with os.scandir, and every file name is parsed into a typed
+# table, so finding the files of a board or sensor is an index lookup instead
+# of a directory listing and a split of each name. The table is stored with the
+# mtime and size of each file, and only new or changed files are parsed again.
+# This is the only place file names are parsed, and reads and adds find their
+# files here.
+
+import pandas as pd
+import os
+import typing
+import threading
+
+# IDC_EM_Analysis directory, the parent of this file's directory
+IDC_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Path of the stored catalog, next to master_cached.csv
+catalog_path = os.path.join(IDC_directory, "catalog.parquet")
+
+# Columns of the catalog. Directory is relative to IDC_directory. Kind is one
+# of "CF", "CV", "Current", "Board Image" and "Sensor Image". Parsed is False
+# for names that don't follow the naming convention, whose name columns are
+# missing
+catalog_scan_columns = ["Directory", "File Name", "Mtime", "Size"]
+catalog_columns = catalog_scan_columns + [
+    "Kind", "Age", "Parsed", "Batch", "Pattern", "Board ID", "Sensor", "Date", "Iteration"
+]
+
+# Types of the catalog columns
+catalog_types = {
+    "Directory": "category",
+    "File Name": "object",
+    "Mtime": "int64",
+    "Size": "int64",
+    "Kind": pd.CategoricalDtype(["CF", "CV", "Current", "Board Image", "Sensor Image"]),
+    "Age": pd.CategoricalDtype(["PRISTINE", "EXPOSED"]),
+    "Parsed": "bool",
+    "Batch": "Int64",
+    "Pattern": "Int64",
+    "Board ID": "object",
+    "Sensor": pd.CategoricalDtype(["U1", "U2", "U3", "U4"]),
+    "Date": "datetime64[ns]",
+    "Iteration": "Int64"
+}
+
+# Naming conventions of each kind of file, as regular expressions. For example
+# 03_01_0026_U1_20250117_CF_1.csv, 03_04_0096_U3_20250303_I.csv,
+# 03_01_0246_000.jpg and 03_01_0036_001_U1.jpg. Sensors are matched in either
+# case, because some files use a lowercase u
+board_id_pattern = r"(?P<Batch>\d{2})_(?P<Pattern>\d{2})_(?P<Board>\d{4})"
+name_patterns = {
+    "CF": board_id_pattern + r"_(?P<Sensor>[Uu][1-4])_(?P<Date>\d{8})_CF_(?P<Iteration>\d+)\.csv",
+    "CV": board_id_pattern + r"_(?P<Sensor>[Uu][1-4])_(?P<Date>\d{8})_CV_(?P<Iteration>\d+)\.csv",
+    "Current": board_id_pattern + r"_(?P<Sensor>[Uu][1-4])_(?P<Date>\d{8})_I\.csv",
+    "Board Image": board_id_pattern + r"_(?P<Iteration>\d{3})\.(?:jpg|png)",
+    "Sensor Image": board_id_pattern + r"_(?P<Iteration>\d{3})_(?P<Sensor>[Uu][1-4])\.(?:jpg|png)"
+}
+
+# Get the directories to catalog, as a dict of directory, relative to
+# IDC_directory, to the kind and age of its files. Ages come from the directory
+# names, and CurrentTime files have no age
+def get_catalog_directories():
+    directories = {"CurrentTime": ("Current", None)}
+    for cf_or_cv in ["CF", "CV"]:
+        for age in ["PRISTINE", "EXPOSED"]:
+            directories[os.path.join(cf_or_cv, f"{cf_or_cv}_{age}")] = (cf_or_cv, age)
+
+    # Imgscans_<age>_sensors hold sensor images, and the others board images
+    with os.scandir(IDC_directory) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith("Imgscans_"):
+                age = "PRISTINE" if "PRISTINE" in entry.name else "EXPOSED"
+                kind = "Sensor Image" if entry.name.endswith("_sensors") else "Board Image"
+                directories[entry.name] = (kind, age)
+
+    return directories
+
+# Scan the catalog directories once, getting the directory, name, mtime and
+# size of every file
+def scan_catalog_files(directories: dict):
+    files = []
+    for directory in directories:
+        try:
+            with os.scandir(os.path.join(IDC_directory, directory)) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((directory, entry.name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            continue
+
+    return pd.DataFrame(files, columns=catalog_scan_columns)
+
+# Parse the names of scanned files into the catalog columns. The names of each
+# kind are parsed together with one vectorized str.extract
+def parse_catalog_files(files: pd.DataFrame, directories: dict):
+    kinds = files["Directory"].map(lambda directory: directories[directory][0])
+    ages = files["Directory"].map(lambda directory: directories[directory][1])
+    parsed = files.assign(Kind=kinds, Age=ages, Parsed=False)
+
+    names = pd.DataFrame(index=files.index, columns=["Batch", "Pattern", "Board", "Sensor", "Date", "Iteration"],
+                         dtype="object")
+    for kind, pattern in name_patterns.items():
+        is_kind = kinds == kind
+        if not is_kind.any():
+            continue
+
+        components = files.loc[is_kind, "File Name"].str.extract("^" + pattern + "$")
+        names.loc[components.index, components.columns] = components
+
+    parsed["Parsed"] = names["Batch"].notna()
+    parsed["Batch"] = pd.to_numeric(names["Batch"]).astype("Int64")
+    parsed["Pattern"] = pd.to_numeric(names["Pattern"]).astype("Int64")
+    parsed["Board ID"] = (names["Batch"] + "_" + names["Pattern"] + "_" + names["Board"]).where(parsed["Parsed"])
+    parsed["Sensor"] = names["Sensor"].str.upper()
+    parsed["Date"] = pd.to_datetime(names["Date"], format="%Y%m%d", errors="coerce")
+    parsed["Iteration"] = pd.to_numeric(names["Iteration"]).astype("Int64")
+
+    return parsed[catalog_columns].astype(catalog_types)
+
+# Write df to a Parquet file at path. It's written to a temporary file next to
+# path first, which then replaces path, so a reader in another session never
+# sees a half-written file
+def write_parquet(df: pd.DataFrame, path: str, **kwargs):
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_parquet(temporary_path, **kwargs)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+# Last catalog returned by get_catalog, which is returned again while no file
+# has changed, so the stored catalog isn't reread on every call
+catalog_cache = {}
+catalog_cache_lock = threading.Lock()
+
+# Get the catalog of all data files, see catalog_columns. The directories are
+# scanned every call, which only stats the files, and only the files that are
+# new or changed since the stored catalog are parsed. The stored catalog is
+# written when anything changed
+def get_catalog():
+    directories = get_catalog_directories()
+    files = scan_catalog_files(directories).astype({"Directory": "object"})
+
+    with catalog_cache_lock:
+        cached = catalog_cache.get("catalog")
+    if cached is not None and cached[0].equals(files):
+        return cached[1].copy(deep=False)
+
+    try:
+        stored = pd.read_parquet(catalog_path)
+        stored = stored.astype({"Directory": "object"})
+    except FileNotFoundError:
+        stored = pd.DataFrame(columns=catalog_columns)
+
+    # Files whose directory, name, mtime and size all match are unchanged
+    unchanged = stored.merge(files, on=catalog_scan_columns, how="inner")
+    if len(unchanged) == len(files) == len(stored):
+        catalog = unchanged.astype(catalog_types)
+    else:
+        changed = files.merge(unchanged[catalog_scan_columns], on=catalog_scan_columns, how="left", indicator=True)
+        changed = changed[changed["_merge"] == "left_only"][catalog_scan_columns].reset_index(drop=True)
+
+        frames = [frame for frame in [unchanged, parse_catalog_files(changed, directories)] if len(frame) > 0]
+        if len(frames) > 0:
+            catalog = pd.concat([frame.astype(catalog_types) for frame in frames], ignore_index=True)
+        else:
+            catalog = pd.DataFrame(columns=catalog_columns)
+        catalog = catalog.sort_values(["Directory", "File Name"], ignore_index=True).astype(catalog_types)
+
+        write_parquet(catalog, catalog_path, index=False)
+
+    with catalog_cache_lock:
+        catalog_cache["catalog"] = (files, catalog)
+    return catalog.copy(deep=False)
+
+# Get the path of a file of the catalog from its directory and name
+def get_catalog_path(directory: str, file_name: str):
+    return os.path.join(IDC_directory, directory, file_name)
+
+# Get the CSV files of the kinds from the catalog, parsed or not, with the
+# catalog columns. These are the files of the consolidated stores of reads
+def get_catalog_csv_files(kinds: list):
+    catalog = get_catalog()
+    files = catalog[catalog["Kind"].isin(kinds) & catalog["File Name"].str.endswith(".csv")]
+
+    return files.reset_index(drop=True)
+
+# Get the parsed files of a kind, and optionally an age, from the catalog,
+# indexed by board ID and sensor for lookups. Unparsed names are left out
+def get_catalog_files(kind: typing.Literal["CF", "CV", "Current", "Board Image", "Sensor Image"],
+                      age: typing.Optional[typing.Literal["EXPOSED", "PRISTINE"]] = None):
+    catalog = get_catalog()
+    files = catalog[(catalog["Kind"] == kind) & catalog["Parsed"]]
+    if age is not None:
+        files = files[files["Age"] == age]
+
+    return files.set_index(["Board ID", "Sensor"], drop=False).sort_index()
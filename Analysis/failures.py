@@ -0,0 +1,87 @@
+# Detection of sensor failures from the CurrentTime traces. A sensor fails when
+# dendrites bridge its electrodes, and its leakage current jumps up to the
+# compliance limit of the source meter, which ends the test. Every detector here
+# runs on all traces at once with NumPy, instead of looping over traces.
+
+import pandas as pd
+import numpy as np
+
+# Current at which a sensor is considered failed. This is the compliance limit,
+# so a trace ends soon after crossing it
+failure_threshold = 5.0  # mA
+
+# A derivative spike is a rise in current faster than this many times the
+# median absolute rate of change of the trace
+spike_factor = 10.0
+
+# A step change is a rise in current of at least this much between two
+# consecutive samples
+step_threshold = 0.5  # mA
+
+# Columns added to master by detect_failures
+failure_columns = [
+    "Detected Time to Failure (ms)", "Spike Time (ms)", "Step Time (ms)", "Peak Current (mA)"
+]
+
+# Detect the failure of every trace. traces has the "File Name", "Current (mA)"
+# and "Time (ms)" columns of the CurrentTime store. Returns a DataFrame indexed
+# by file name with the failure_columns, which are NaN where nothing was found:
+# - Detected Time to Failure (ms): first time the current reaches
+#   failure_threshold
+# - Spike Time (ms): first time the rate of change spikes, see spike_factor
+# - Step Time (ms): first time the current steps up, see step_threshold
+# - Peak Current (mA): the maximum current of the trace
+# The first interval of each trace, where the current settles from 0, is not
+# used for spikes or steps
+def detect_failures(traces: pd.DataFrame):
+    traces = traces.sort_values(["File Name", "Time (ms)"], ignore_index=True)
+    codes, file_names = pd.factorize(traces["File Name"].astype(str))
+    current = traces["Current (mA)"].to_numpy(dtype="float64")
+    time = traces["Time (ms)"].to_numpy(dtype="float64")
+
+    # Get the time of the first sample of each trace where mask is True
+    def first_time(mask):
+        result = np.full(len(file_names), np.nan)
+        indices = np.flatnonzero(mask)
+        trace_codes, first = np.unique(codes[indices], return_index=True)
+        result[trace_codes] = time[indices[first]]
+        return result
+
+    # Sample i is the first of its trace. Interval i, from sample i to i + 1,
+    # is used if both are in the same trace and sample i isn't the first
+    starts = np.r_[True, codes[1:] != codes[:-1]]
+    valid = ~starts[1:] & ~starts[:-1]
+
+    # Rise and rate of rise of each interval, in mA and mA/s
+    step = np.diff(current)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = step / np.diff(time) * 1000
+
+    # Median absolute rate of each trace, broadcast to each interval
+    median_rate = pd.Series(np.where(valid, np.abs(rate), np.nan)).groupby(codes[:-1]).transform("median")
+
+    # Spikes and steps are timed at the sample after the interval
+    spike = np.r_[False, valid & (rate > spike_factor * median_rate.to_numpy())]
+    step_up = np.r_[False, valid & (step >= step_threshold)]
+
+    failures = pd.DataFrame(index=pd.Index(file_names, name="File Name"))
+    failures["Detected Time to Failure (ms)"] = first_time(current >= failure_threshold)
+    failures["Spike Time (ms)"] = first_time(spike)
+    failures["Step Time (ms)"] = first_time(step_up)
+    failures["Peak Current (mA)"] = np.maximum.reduceat(current, np.flatnonzero(starts)) if len(current) else []
+
+    return failures
+
+# Get the master rows where the detected time to failure disagrees with the
+# manually entered "Time to Failure (ms)" by more than tolerance, or where only
+# one of them exists. master must have the failure_columns
+def get_failure_disagreements(master: pd.DataFrame, tolerance: float = 1000):  # ms
+    manual = master["Time to Failure (ms)"]
+    detected = master["Detected Time to Failure (ms)"]
+
+    # Only rows with a trace are compared
+    has_trace = master["Peak Current (mA)"].notna()
+    disagrees = ((manual - detected).abs() > tolerance) | (manual.isna() != detected.isna())
+
+    columns = ["Board ID", "Sensor", "Current", "Time to Failure (ms)"] + failure_columns
+    return master.loc[has_trace & disagrees, columns]
@@ -0,0 +1,65 @@
+# A cache of rendered matplotlib figures, stored as PNG bytes. Panels of the
+# Streamlit app that are drawn again with the same filters and data are served
+# from here instead of being plotted again. The cache is shared by all sessions.
+
+import matplotlib.pyplot as plt
+import io
+import threading
+import typing
+from collections import OrderedDict
+
+# Most PNG bytes kept in the cache. When it is full, the least recently used
+# figures are evicted first
+max_figure_cache_bytes = 128 * 1024 * 1024
+
+# PNGs of each cached key, ordered from least to most recently used
+figure_cache = OrderedDict()
+figure_cache_counts = {"hits": 0, "misses": 0, "bytes": 0}
+figure_cache_lock = threading.Lock()
+
+# Get the hit and miss counts, and size, of the figure cache
+def get_figure_cache_info():
+    with figure_cache_lock:
+        return {**figure_cache_counts, "entries": len(figure_cache)}
+
+# Empty the figure cache and reset its counts
+def clear_figure_cache():
+    with figure_cache_lock:
+        figure_cache.clear()
+        figure_cache_counts.update(hits=0, misses=0, bytes=0)
+
+# Render a figure to PNG bytes, the same way st.pyplot does, and close it
+def figure_to_png(figure):
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+    plt.close(figure)
+
+    return buffer.getvalue()
+
+# Get the PNGs of the figures for key, calling plot to make them if they aren't
+# cached. plot returns an iterable of figures. key should contain everything the
+# figures depend on, such as the panel name, filter values, and data version
+def get_figure_pngs(key: tuple, plot: typing.Callable):
+    with figure_cache_lock:
+        if key in figure_cache:
+            figure_cache_counts["hits"] += 1
+            figure_cache.move_to_end(key)
+            return figure_cache[key]
+        figure_cache_counts["misses"] += 1
+
+    pngs = [figure_to_png(figure) for figure in plot()]
+    size = sum(len(png) for png in pngs)
+
+    with figure_cache_lock:
+        # Skip storing figures that were stored by another session meanwhile,
+        # or that are too big to ever fit
+        if key not in figure_cache and size <= max_figure_cache_bytes:
+            figure_cache[key] = pngs
+            figure_cache_counts["bytes"] += size
+
+            # Evict the least recently used figures until the cache fits
+            while figure_cache_counts["bytes"] > max_figure_cache_bytes:
+                _, evicted = figure_cache.popitem(last=False)
+                figure_cache_counts["bytes"] -= sum(len(png) for png in evicted)
+
+    return pngs
@@ -1,142 +1,442 @@
 # A place for intensive code that cannot be reasonably ran each time the
 # DataFrame is generated. This code should only be run occasionally when new
 # data is added.
+#
+# Run from the Analysis directory, for example:
+#   python -m generators --workers 4 --boards 03_04 03_07_0246
+# See python -m generators --help for the options
 
 import reads
+import catalog
+import pandas as pd
+import numpy as np
 import cv2
 import os
 import typing
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# Generate the cropped sensor images and store them
-def gen_sensor_images():
-    # Stores the coords as percentages of the sensor bounds
-    # Sample use: pattern_to_sensor_to_coords[pattern][sensor]["x1"|"y2"...]
-
-    #debug
-    print(f"Current working directory: {os.getcwd()}")
-    print(f"Contents of current directory: {os.listdir('.')}")
-    print(f"Contents of parent directory: {os.listdir('..')}")
-
-
-    pattern_to_sensor_to_coords = {
-        1: {
-            "U1": {"x1":0.1012, "x2":0.3067, "y1":0.576, "y2":0.6601},
-            "U2": {"x1":0.1377, "x2":0.2395, "y1":0.09905, "y2":0.2684},
-            "U3": {"x1":0.7647, "x2":0.8325, "y1":0.07259, "y2":0.3275},
-            "U4": {"x1":0.7736, "x2":0.8254, "y1":0.434, "y2":0.7743}
-        },
-        4: {
-            "U1": {"x1":0.09917, "x2":0.3052, "y1":0.5761, "y2":0.6606},
-            "U2": {"x1":0.1369, "x2":0.2389, "y1":0.09948, "y2":0.2688},
-            "U3": {"x1":0.7653, "x2":0.8328, "y1":0.07529, "y2":0.3299},
-            "U4": {"x1":0.773, "x2":0.8243, "y1":0.4364, "y2":0.7764}
-        },
-        7: {
-            "U1": {"x1":0.1011, "x2":0.3066, "y1":0.5776, "y2":0.6608},
-            "U2": {"x1":0.137, "x2":0.2387, "y1":0.1002, "y2":0.2691},
-            "U3": {"x1":0.7646, "x2":0.8324, "y1":0.07282, "y2":0.3275},
-            "U4": {"x1":0.7737, "x2":0.8255, "y1":0.4342, "y2":0.7739}
-        },
-        10: {
-            "U1": {"x1":0.09913, "x2":0.3055, "y1":0.5753, "y2":0.6594},
-            "U2": {"x1":0.1367, "x2":0.2384, "y1":0.0993, "y2":0.2683},
-            "U3": {"x1":0.7644, "x2":0.8324, "y1":0.07448, "y2":0.3286},
-            "U4": {"x1":0.7727, "x2":0.8243, "y1":0.4351, "y2":0.7745}
-        }
+# Stores the coords as percentages of the sensor bounds
+# Sample use: pattern_to_sensor_to_coords[pattern][sensor]["x1"|"y2"...]
+pattern_to_sensor_to_coords = {
+    1: {
+        "U1": {"x1":0.1012, "x2":0.3067, "y1":0.576, "y2":0.6601},
+        "U2": {"x1":0.1377, "x2":0.2395, "y1":0.09905, "y2":0.2684},
+        "U3": {"x1":0.7647, "x2":0.8325, "y1":0.07259, "y2":0.3275},
+        "U4": {"x1":0.7736, "x2":0.8254, "y1":0.434, "y2":0.7743}
+    },
+    4: {
+        "U1": {"x1":0.09917, "x2":0.3052, "y1":0.5761, "y2":0.6606},
+        "U2": {"x1":0.1369, "x2":0.2389, "y1":0.09948, "y2":0.2688},
+        "U3": {"x1":0.7653, "x2":0.8328, "y1":0.07529, "y2":0.3299},
+        "U4": {"x1":0.773, "x2":0.8243, "y1":0.4364, "y2":0.7764}
+    },
+    7: {
+        "U1": {"x1":0.1011, "x2":0.3066, "y1":0.5776, "y2":0.6608},
+        "U2": {"x1":0.137, "x2":0.2387, "y1":0.1002, "y2":0.2691},
+        "U3": {"x1":0.7646, "x2":0.8324, "y1":0.07282, "y2":0.3275},
+        "U4": {"x1":0.7737, "x2":0.8255, "y1":0.4342, "y2":0.7739}
+    },
+    10: {
+        "U1": {"x1":0.09913, "x2":0.3055, "y1":0.5753, "y2":0.6594},
+        "U2": {"x1":0.1367, "x2":0.2384, "y1":0.0993, "y2":0.2683},
+        "U3": {"x1":0.7644, "x2":0.8324, "y1":0.07448, "y2":0.3286},
+        "U4": {"x1":0.7727, "x2":0.8243, "y1":0.4351, "y2":0.7745}
     }
+}
 
-    # Helper function used to generate a singular sensor image and write to file,
-    # given a master row and age
-    def gen_sensor_image(master_row, age: typing.Literal["EXPOSED", "PRISTINE"]):
+# Record of the board images that sensor images were cropped from, stored next
+# to master_cached.csv. A board whose image has the same mtime and size, and
+# whose pattern and alignment are the same, isn't cropped again
+sensor_images_manifest_path = os.path.join(reads.IDC_directory, "sensor_images_manifest.parquet")
+sensor_images_manifest_columns = ["Age", "File Name", "Mtime", "Size", "Pattern", "Aligned"]
 
-        # edit - original: matching_file_names = [file for file in os.listdir(f"Imgscans_{age}_edited")
-        # if file.startswith(master_row["Board ID"])]
-        #matching_file_names = [file for file in os.listdir(f"../Imgscans_{age}") if file.startswith(master_row["Board ID"])]
+# Index the board images of an age from the catalog. Returns a dict
+# of board ID to the file name, mtime and size of its image
+def index_board_images(age: typing.Literal["EXPOSED", "PRISTINE"]):
+    directory = reads.get_board_image_directory(age)
+    if not os.path.isdir(directory):
+        return {}
 
-        # edit:
-        # Get list of file names that start with this board ID
-        print(f"Processing: {master_row['Board ID']}, {master_row['Sensor']}, {age}")
+    # Take the first file of each board, in file name order
+    # TODO Handle cases of boards having multiple scans, possibly by
+    # using the iteration value
+    files = catalog.get_catalog_files("Board Image", age)
+    files = files[files["Directory"] == os.path.relpath(directory, reads.IDC_directory)]
+    files = files.sort_values("File Name").drop_duplicates(subset="Board ID", keep="first")
 
-        # updated: use correct file path
-        path = f"../Imgscans_PRISTINE_templates" if age == "PRISTINE" else f"../Imgscans_{age}"
+    return {board_id: (file_name, mtime, size) for board_id, file_name, mtime, size
+            in zip(files["Board ID"], files["File Name"], files["Mtime"], files["Size"])}
 
-        matching_file_names = [file for file in os.listdir(path) if file.startswith(master_row["Board ID"])]
+# File formats that sensor images can be written in
+sensor_image_formats = ["jpg", "png"]
 
-        # If no files are found, return
-        if len(matching_file_names) == 0:
-            return
-        
-        # Take the first found file and use it
-        # TODO Handle cases of boards having multiple scans, possibly by using the
-        # iteration value
-        file_name = matching_file_names[0]
+# Get the file name of a cropped sensor image
+def get_sensor_image_name(board_id: str, sensor: str, age: typing.Literal["EXPOSED", "PRISTINE"],
+                          image_format: str = "jpg"):
+    # TODO Add date. Date isn't used yet because of dates missing in master
+    #month, day, year = tuple(map(int, master_row["Date"].split("/")))
+    return f"{board_id}_{'000' if age == 'PRISTINE' else '001'}_{sensor}.{image_format}"
 
-        # Read board image
-        board_img = reads.get_board_image(file_name, age)
+# Get every sensor of a decoded board image, by sensor. The sensor images are
+# views of the board image, so nothing is copied
+def crop_sensors(board_img, pattern: int):
+    # Get width and height, to be used for calculating crop coords
+    height, width, _ = board_img.shape
 
-        # Get width and height, to be used for calculating crop coords
-        height, width, _ = board_img.shape
+    sensor_images = {}
+    for sensor, coords in pattern_to_sensor_to_coords[pattern].items():
         # Calculate crop coords based on crop percentages
-        coords = pattern_to_sensor_to_coords[master_row["Pattern"]][master_row["Sensor"]]
         x1 = round(coords["x1"] * width)
         x2 = round(coords["x2"] * width)
         y1 = round(coords["y1"] * height)
         y2 = round(coords["y2"] * height)
 
-        # Get the cropped sensor
-        sensor_image = board_img[y1:y2, x1:x2]
-        
-        # Get values to construct file name, and store file
-        # TODO Add date. Date isn't used yet because of dates missing in master
-        #month, day, year = tuple(map(int, master_row["Date"].split("/")))
-        file_name = f"{master_row["Board ID"]}_{"000" if age == "PRISTINE" else "001"}_{master_row["Sensor"]}.jpg"
+        sensor_images[sensor] = board_img[y1:y2, x1:x2]
 
-        # Write to file
-        cv2.imwrite(f"../Imgscans_{age}_sensors/{file_name}", sensor_image)
+    return sensor_images
 
-    master = reads.get_master()
+# Warp a board image onto the geometry of its pattern's template, so the crop
+# coords land on the same features of every board. transform is from
+# register_board_image, or None to leave the board image as it is
+def align_board_image(board_img, transform: typing.Optional[dict] = None):
+    if transform is None:
+        return board_img
+
+    # The matrix maps template coords to board coords, so it's applied inversely
+    return cv2.warpAffine(board_img, transform["matrix"], transform["size"],
+                          flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+
+# Write a cropped sensor image to file
+def write_sensor_image(sensor_image, board_id: str, sensor: str, age: typing.Literal["EXPOSED", "PRISTINE"],
+                       image_format: str = "jpg"):
+    sensor_image_name = get_sensor_image_name(board_id, sensor, age, image_format)
+    cv2.imwrite(reads.get_sensor_image_path(sensor_image_name, age), sensor_image)
+
+# Crop every sensor from a board image, decoding it once, and write them.
+# transform is passed to align_board_image. Returns the number of sensor images
+# written, which is 0 if the board image can't be read. This runs in the worker
+# processes of gen_sensor_images
+def gen_board_sensor_images(board_id: str, file_name: str, pattern: int, age: typing.Literal["EXPOSED", "PRISTINE"],
+                            image_format: str = "jpg", transform: typing.Optional[dict] = None):
+    board_img = reads.get_board_image(file_name, age)
+    if board_img is None:
+        return 0
+    board_img = align_board_image(board_img, transform)
 
-    # Drop NaNs because these columns are needed for creating the file name
-    master.dropna(subset=["Board ID", "Date", "Sensor"], inplace=True)
+    sensor_images = crop_sensors(board_img, pattern)
+    for sensor, sensor_image in sensor_images.items():
+        write_sensor_image(sensor_image, board_id, sensor, age, image_format)
 
-    # Set index to a unique sensor identifier
-    master.set_index(["Board ID", "Sensor"], inplace=True, drop=False)
-    master.sort_index(inplace=True)
+    return len(sensor_images)
 
-    # Drop duplicate indices
-    master = master[~master.index.duplicated(keep='first')]
+# Columns of the DataFrame returned by gen_sensor_image_features
+sensor_image_features_columns = ["Board ID", "Pattern", "Sensor", "Age"] + reads.image_feature_names + ["Thumbnail"]
 
-    # Counter variable for printed progress
-    generated = 0
+# Get the features and thumbnail of every sensor of a board image, see
+# reads.get_image_features, computed on the decoded board image, so the sensors
+# are never encoded and decoded as JPEGs. With write_images, the sensor images
+# are also written. transform is passed to align_board_image. Returns rows of
+# sensor_image_features_columns, with none if the board image can't be read.
+# This runs in the worker processes of gen_sensor_image_features
+def get_board_sensor_features(board_id: str, file_name: str, pattern: int,
+                              age: typing.Literal["EXPOSED", "PRISTINE"], write_images=False,
+                              image_format: str = "jpg", transform: typing.Optional[dict] = None):
+    board_img = reads.get_board_image(file_name, age)
+    if board_img is None:
+        return []
+    board_img = align_board_image(board_img, transform)
 
-    for pristine_file_name in os.listdir("../Imgscans_PRISTINE_templates"):
-        for sensor in ["U1", "U2", "U3", "U4"]:
-            batch, pattern, id, _ = pristine_file_name.split("_")
-            board_id = "_".join([batch, pattern, id])
+    rows = []
+    for sensor, sensor_image in crop_sensors(board_img, pattern).items():
+        if write_images:
+            write_sensor_image(sensor_image, board_id, sensor, age, image_format)
 
-            # Get master rows that match this file
-            rows = master[(master["Board ID"] == board_id) & (master["Sensor"] == sensor)]
+        features, thumbnail = reads.get_image_features(sensor_image)
+        rows.append((board_id, pattern, sensor, age, *features, thumbnail))
+
+    return rows
+
+# Get the patterns of the boards in master, by board ID. Only patterns with
+# known crop coords are kept
+def get_board_patterns():
+    master = reads.get_master()
 
-            # Skip if no master rows match
-            if len(rows) == 0:
+    # Drop NaNs because these columns are needed for cropping and naming
+    master = master.dropna(subset=["Board ID", "Sensor", "Pattern"])
+
+    # Get the pattern of each board from its first row
+    board_patterns = master.drop_duplicates("Board ID").set_index("Board ID")["Pattern"].astype(int)
+    return board_patterns[board_patterns.isin(list(pattern_to_sensor_to_coords))]
+
+# List the board images to process, as tuples of board ID, file name, pattern,
+# age, mtime and size. boards limits them to board IDs starting with any of its
+# values
+def get_board_jobs(boards: typing.Optional[list] = None):
+    board_patterns = get_board_patterns()
+
+    jobs = []
+    for age in ["PRISTINE", "EXPOSED"]:
+        for board_id, (file_name, mtime, size) in index_board_images(age).items():
+            if board_id not in board_patterns.index:
                 continue
+            if boards is not None and not board_id.startswith(tuple(boards)):
+                continue
+
+            jobs.append((board_id, file_name, int(board_patterns[board_id]), age, mtime, size))
+
+    return jobs
+
+# Scale that boards are registered at, see reads.image_scale_flags. The
+# misregistration of a scan is a small shift and rotation, which is found at
+# 1/8 scale in a fraction of the time of the full image
+registration_scale = 8
+
+# Stopping criteria of the ECC registration, the most iterations and the
+# smallest change in the correlation coefficient
+registration_iterations = 100
+registration_epsilon = 1e-5
+
+# Record of the transform of each board image onto its pattern's template,
+# stored next to master_cached.csv. A transform is reused while the board image
+# and template have the same mtime and size. Failed registrations are stored
+# with NaN matrices, so they aren't retried until a file changes
+board_transforms_path = os.path.join(reads.IDC_directory, "board_transforms.parquet")
+board_transform_keys = ["Age", "File Name", "Mtime", "Size", "Template", "Template Mtime", "Template Size"]
+board_transform_values = ["M00", "M01", "M02", "M10", "M11", "M12", "Width", "Height", "Correlation"]
+
+# Register a board image onto the template of its pattern with ECC, at
+# registration_scale. Returns the transform for align_board_image, a dict of
+# the 2x3 affine matrix at full scale mapping template coords to board coords,
+# the full size of the template and the correlation coefficient reached, or
+# None if either image can't be read or ECC doesn't converge. template_size is
+# the full (width, height) of the template. This runs in the worker processes
+# of gen_board_transforms
+def register_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], template_file_name: str,
+                         template_size: tuple):
+    template = reads.get_board_image(template_file_name, "PRISTINE", registration_scale)
+    board_img = reads.get_board_image(file_name, age, registration_scale)
+    if template is None or board_img is None:
+        return None
+
+    template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+    board_gray = cv2.cvtColor(board_img, cv2.COLOR_BGR2GRAY)
+
+    # ECC needs images of the same size, so the board is resized to the
+    # template, which is undone by scaling the matrix
+    template_height, template_width = template_gray.shape
+    board_height, board_width = board_gray.shape
+    board_gray = cv2.resize(board_gray, (template_width, template_height), interpolation=cv2.INTER_AREA)
+    resize = np.diag([board_width / template_width, board_height / template_height])
+
+    matrix = np.eye(2, 3, dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, registration_iterations, registration_epsilon)
+    try:
+        correlation, matrix = cv2.findTransformECC(template_gray, board_gray, matrix, cv2.MOTION_AFFINE, criteria,
+                                                   None, 5)
+    except cv2.error:
+        return None
+
+    # Convert from reduced to full scale. The linear part is unchanged, and the
+    # translation grows with the scale. Boards are scanned at the same
+    # resolution as the templates, so they're reduced by the same amount
+    scale = np.diag([template_size[0] / template_width, template_size[1] / template_height])
+    full_matrix = np.hstack([resize @ matrix[:, :2], scale @ resize @ matrix[:, 2:]])
+
+    return {"matrix": full_matrix, "size": tuple(template_size), "correlation": float(correlation)}
+
+# Get the transform of every EXPOSED board in jobs, from get_board_jobs, onto
+# the PRISTINE template of its pattern, registering the boards that aren't in
+# the board transforms record in parallel. The record keeps the transforms of
+# every board, not only those in jobs, and only drops the transforms of boards
+# or templates that changed or were removed. Returns a dict of (age, file name)
+# to the transform, or None where registration failed
+def gen_board_transforms(jobs: list, workers: typing.Optional[int] = None):
+    all_jobs = get_board_jobs()
+
+    # Sample use: templates[pattern] -> (file name, mtime, size)
+    templates = {}
+    for board_id, file_name, pattern, age, mtime, size in all_jobs:
+        if age == "PRISTINE":
+            templates.setdefault(pattern, (file_name, mtime, size))
+
+    # Sample use: current_keys[(age, file name)] -> (age, file name, mtime, size, template, ...)
+    current_keys = {}
+    for board_id, file_name, pattern, age, mtime, size in all_jobs:
+        if age == "EXPOSED" and pattern in templates:
+            current_keys[(age, file_name)] = (age, file_name, mtime, size, *templates[pattern])
+
+    try:
+        record = pd.read_parquet(board_transforms_path)
+    except FileNotFoundError:
+        record = pd.DataFrame(columns=board_transform_keys + board_transform_values)
+
+    # Sample use: stored[(age, file name, mtime, size, template, ...)] -> transform
+    stored = {}
+    for row in record.itertuples(index=False):
+        key = tuple(row[:len(board_transform_keys)])
+        m00, m01, m02, m10, m11, m12, width, height, correlation = row[len(board_transform_keys):]
+        if np.isnan(m00):
+            stored[key] = None
+        else:
+            stored[key] = {"matrix": np.array([[m00, m01, m02], [m10, m11, m12]]),
+                           "size": (int(width), int(height)), "correlation": correlation}
+
+    # Find the boards to register
+    keys = {}
+    for board_id, file_name, pattern, age, mtime, size in jobs:
+        if age == "EXPOSED" and pattern in templates:
+            keys[(age, file_name)] = current_keys[(age, file_name)]
+    missing = [key for key in keys.values() if key not in stored]
+
+    # Get the full size of the templates that are needed
+    template_sizes = {}
+    for key in missing:
+        if key[4] not in template_sizes:
+            template = reads.get_board_image(key[4], "PRISTINE")
+            template_sizes[key[4]] = None if template is None else template.shape[1::-1]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(register_board_image, key[1], key[0], key[4], template_sizes[key[4]]): key
+                   for key in missing if template_sizes[key[4]] is not None}
+        for future in as_completed(futures):
+            stored[futures[future]] = future.result()
+
+    # Save the transforms of the current version of every board, registered in
+    # this run or before
+    rows = []
+    for key in current_keys.values():
+        if key not in stored:
+            continue
+
+        transform = stored[key]
+        if transform is None:
+            rows.append((*key, *[np.nan] * len(board_transform_values)))
+        else:
+            rows.append((*key, *transform["matrix"].ravel(), *transform["size"], transform["correlation"]))
+    record = pd.DataFrame(rows, columns=board_transform_keys + board_transform_values)
+    record.to_parquet(board_transforms_path, index=False)
+
+    return {key: stored.get(full_key) for key, full_key in keys.items()}
+
+# Get the features of every sensor of every board image, straight from the
+# board images, with boards split across processes. Sensor images are only
+# written with write_images. boards is as in get_board_jobs. With align, the
+# EXPOSED boards are aligned to their templates first, see gen_board_transforms.
+# Returns a DataFrame of sensor_image_features_columns
+def gen_sensor_image_features(workers: typing.Optional[int] = None, boards: typing.Optional[list] = None,
+                              write_images=False, image_format: str = "jpg", align=False):
+    if write_images:
+        for age in ["PRISTINE", "EXPOSED"]:
+            os.makedirs(os.path.dirname(reads.get_sensor_image_path("", age)), exist_ok=True)
+
+    jobs = get_board_jobs(boards)
+    transforms = gen_board_transforms(jobs, workers) if align else {}
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(get_board_sensor_features, *job[:4], write_images, image_format,
+                                   transforms.get((job[3], job[1])))
+                   for job in jobs]
+        for future in futures:
+            rows.extend(future.result())
+
+    return pd.DataFrame(rows, columns=sensor_image_features_columns)
+
+# Generate the cropped sensor images and store them. Each board image is
+# decoded once and all of its sensors are cropped, with boards split across
+# processes. With resume, boards whose image is unchanged since it was last
+# cropped the same way, and whose sensor images all exist, are skipped. boards
+# limits the run to board IDs starting with any of its values. With align, the
+# EXPOSED boards are aligned to their templates first, see gen_board_transforms.
+# Returns the numbers of boards cropped and skipped, and of sensor images
+# written
+def gen_sensor_images(resume=True, workers: typing.Optional[int] = None, image_format: str = "jpg",
+                      boards: typing.Optional[list] = None, align=False):
+    try:
+        manifest = pd.read_parquet(sensor_images_manifest_path)
+    except FileNotFoundError:
+        manifest = pd.DataFrame(columns=sensor_images_manifest_columns)
+
+    # Manifests written before alignment was added only hold unaligned crops
+    if "Aligned" not in manifest:
+        manifest["Aligned"] = False
+
+    # Sample use: cropped[(age, file name)] -> (mtime, size, pattern, aligned)
+    cropped = {(age, file_name): (int(mtime), int(size), int(pattern), bool(aligned))
+               for age, file_name, mtime, size, pattern, aligned
+               in manifest[sensor_images_manifest_columns].itertuples(index=False)}
+
+    for age in ["PRISTINE", "EXPOSED"]:
+        os.makedirs(os.path.dirname(reads.get_sensor_image_path("", age)), exist_ok=True)
+
+    # Find the boards to crop
+    jobs = []
+    skipped = 0
+    for job in get_board_jobs(boards):
+        board_id, file_name, pattern, age, mtime, size = job
+
+        unchanged = cropped.get((age, file_name)) == (mtime, size, pattern, align) and all(
+            os.path.isfile(reads.get_sensor_image_path(get_sensor_image_name(board_id, sensor, age, image_format), age))
+            for sensor in pattern_to_sensor_to_coords[pattern])
+        if resume and unchanged:
+            skipped += 1
+            continue
+
+        jobs.append(job)
+
+    transforms = gen_board_transforms(jobs, workers) if align else {}
+
+    # Crop the boards in parallel. The manifest is saved even if the run is
+    # interrupted, so a resumed run skips the boards that were finished
+    written = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(gen_board_sensor_images, *job[:4], image_format,
+                                       transforms.get((job[3], job[1]))): job
+                       for job in jobs}
+            for future in as_completed(futures):
+                board_id, file_name, pattern, age, mtime, size = futures[future]
+                count = future.result()
+                if count > 0:
+                    cropped[(age, file_name)] = (mtime, size, pattern, align)
+                    written += count
+    finally:
+        manifest = pd.DataFrame([(age, file_name, *values) for (age, file_name), values in cropped.items()],
+                                columns=sensor_images_manifest_columns)
+        manifest.to_parquet(sensor_images_manifest_path, index=False)
+
+    return len(jobs), skipped, written
+
+# Command line entry point. Crops the sensor images and prints the time taken
+# and throughput
+def main(args: typing.Optional[list] = None):
+    parser = argparse.ArgumentParser(prog="python -m generators",
+                                     description="Crop the sensor images from the board images.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", dest="resume", action="store_true", default=True,
+                      help="skip boards whose image is unchanged since it was cropped (default)")
+    mode.add_argument("--force", dest="resume", action="store_false",
+                      help="crop every board again")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--format", dest="image_format", choices=sensor_image_formats, default="jpg",
+                        help="file format of the sensor images (default: jpg)")
+    parser.add_argument("--boards", nargs="+", default=None, metavar="BOARD",
+                        help="only crop board IDs starting with these values, e.g. 03_04 or 03_04_0096")
+    parser.add_argument("--align", action="store_true",
+                        help="align EXPOSED boards to their pattern's template before cropping")
+    arguments = parser.parse_args(args)
+
+    start = time.perf_counter()
+    cropped_boards, skipped_boards, written_images = gen_sensor_images(
+        resume=arguments.resume, workers=arguments.workers, image_format=arguments.image_format,
+        boards=arguments.boards, align=arguments.align)
+    elapsed = time.perf_counter() - start
+
+    print(f"Cropped {cropped_boards} boards ({written_images} sensor images), skipped {skipped_boards} unchanged")
+    print(f"Took {elapsed:.2f} s, {cropped_boards / elapsed:.1f} boards/s, {written_images / elapsed:.1f} images/s")
 
-            # Generate image using the first found row
-            gen_sensor_image(rows.iloc[0], "PRISTINE")
-            
-            # Show progress
-            generated += 1
-            print(f"Images generated: {generated}")
-
-    # For each row in master, generate the EXPOSED image if possible
-    for _, row in master.iterrows():
-        gen_sensor_image(row, "EXPOSED")
-        
-        # Show progress
-        generated += 1
-        print(f"Images generated: {generated}")
-
-# Run Area ---------------------------------------------------------------------
-# Uncomment lines to run the generators
-
-gen_sensor_images()
+if __name__ == "__main__":
+    main()
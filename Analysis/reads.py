@@ -3,19 +3,28 @@
 # file, because there should be only one valid way to read data. Data loss
 # should only occur here if it really needs to.
 
+import catalog
 import pandas as pd
 import numpy as np
 import cv2
 import typing
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# debug
-# new method of reading data to avoid errors:
-# get reads.py directory
-reads_directory = os.path.dirname(os.path.abspath(__file__))
+# get IDC_EM_Analysis directory, which the catalog finds from the reads.py
+# directory
+IDC_directory = catalog.IDC_directory
 
-# get IDC_EM_Analysis directory
-IDC_directory = os.path.dirname(reads_directory)
+# Paths of the cached result of adds.get_master(). The Parquet file stores the
+# column types and is preferred. The CSV is kept as a fallback and an export
+master_cached_parquet_path = os.path.join(IDC_directory, "master_cached.parquet")
+master_cached_csv_path = os.path.join(IDC_directory, "master_cached.csv")
+
+# Types of master columns, applied by cast_master_types. Other numeric columns
+# are stored as floats, and the remaining columns keep their read type
+master_categorical_columns = ["Solution", "Sensor", "Status"]
+master_integer_columns = ["Pattern"]
 
 # Get the master data as a DataFrame with proper data types
 # Future idea: Replace all occurrences of file names in cells with their
@@ -26,6 +35,9 @@ def get_master():
     csv_path = os.path.join(IDC_directory, "IDCSubmersionMasterlist_20250505.csv")
     master = pd.read_csv(csv_path)
 
+    # The masterlist spells pH as "Ph"
+    master.rename(columns={"Ph": "pH"}, inplace=True)
+
     # Cast numeric columns to numbers
     numeric_cols = ["Voltage", "Pattern"]
     master[numeric_cols] = master[numeric_cols].apply(lambda col: pd.to_numeric(col, errors="coerce"))
@@ -33,17 +45,71 @@ def get_master():
 
     return master
 
+# Cast master columns to the types they are cached with: categorical labels, a
+# nullable integer Pattern, and floats for the measurements
+def cast_master_types(master: pd.DataFrame):
+    master = master.copy()
+
+    for column in master.columns:
+        if column in master_categorical_columns:
+            master[column] = master[column].astype("category")
+        elif column in master_integer_columns:
+            master[column] = pd.to_numeric(master[column], errors="coerce").astype("Int64")
+        elif pd.api.types.is_numeric_dtype(master[column]):
+            master[column] = master[column].astype("float64")
+
+    return master
+
 # Get the last cached version of the result of adds.get_master()
 def get_master_cached():
+    # Read the Parquet cache, which already has the proper types
     try:
-        # Read the file
-        cached_path = os.path.join(IDC_directory, "master_cached.csv")
-        return pd.read_csv(cached_path)
+        return pd.read_parquet(master_cached_parquet_path)
+    except FileNotFoundError:
+        pass
 
+    # Fall back to the CSV cache, and cast it to the same types
+    try:
+        cached = pd.read_csv(master_cached_csv_path)
     except FileNotFoundError:
         # Return None if not readable
         return None
 
+    return cast_master_types(cached)
+
+# Read a CSV file of numbers as a DataFrame of floats. Columns are parsed as
+# floats directly, and only files with non-number cells take the slower path of
+# coercing each column. Rows with non-numbers are dropped
+def read_numeric_csv(file_path: str):
+    try:
+        df = pd.read_csv(file_path, dtype="float64")
+    except ValueError:
+        df = pd.read_csv(file_path)
+        # Cast all columns to numbers
+        df = df.apply(lambda col: pd.to_numeric(col, errors="coerce"))
+
+    # Drop non-number rows
+    return df.dropna()
+
+# Read many files concurrently with read_file, which takes a file name and
+# returns a DataFrame or None. The files are concatenated with a "File Name"
+# column, and files that couldn't be read are skipped. workers is the thread
+# count, where None uses the ThreadPoolExecutor default
+def read_batch(file_names: list, read_file: typing.Callable, workers: typing.Optional[int] = None):
+    file_names = list(file_names)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        dfs = list(executor.map(read_file, file_names))
+
+    dfs = [
+        df.assign(**{"File Name": file_name})
+        for file_name, df in zip(file_names, dfs)
+        if df is not None and len(df) > 0
+    ]
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=["File Name"])
+
+    return pd.concat(dfs, ignore_index=True)
+
 # Get a CurrentTime file as a DataFrame with proper data types
 def get_current_time(file_name: str):
 
@@ -52,74 +118,353 @@ def get_current_time(file_name: str):
 
     try:
         file_path=os.path.join(IDC_directory, "CurrentTime", file_name)
-        current_time=pd.read_csv(file_path)
+        current_time=read_numeric_csv(file_path)
     except FileNotFoundError:
         return None
 
-    # Cast all columns to numbers
-    current_time = current_time.apply(lambda col: pd.to_numeric(col, errors="coerce"))
-    # Drop non-number rows
-    current_time.dropna(inplace=True)
-
     return current_time
 
+# Get many CurrentTime files as one DataFrame, with a "File Name" column. See
+# read_batch
+def get_current_time_batch(file_names: list, workers: typing.Optional[int] = None):
+    return read_batch(file_names, get_current_time, workers=workers)
 
-# Get a CF/CV file, (PRISTINE/EXPOSED), as a DataFrame with proper data types
-def get_cf_or_cv(file_name: str):
-    # Ensure file_name is string before using split
-    if type(file_name) != str:
-        return None
+# Get a CF/CV file, (PRISTINE/EXPOSED), as a DataFrame with proper data types.
+# directory is the file's directory in the catalog
+def get_cf_or_cv(file_name: str, directory: str):
+    try:
+        file_path=catalog.get_catalog_path(directory, file_name)
+        df=read_numeric_csv(file_path)
 
-    # Get 7 string components of file name
-    components = file_name.split(".")[0].split("_")
-    # Return None if name is unconventional
-    if len(components) != 7:
+    except FileNotFoundError:
         return None
 
-    # Get components needed for file path
-    iteration = int(components[6])
-    age = "PRISTINE" if iteration == 0 else "EXPOSED"
-    cf_or_cv = components[5]
+    return df
 
-    try:
-        file_path=os.path.join(IDC_directory, cf_or_cv, f"{cf_or_cv}_{age}", file_name)
-        df=pd.read_csv(file_path)
+# Consolidated stores combine many small files into one Parquet file, with a
+# manifest of the name, mtime and size of each file it was built from. The
+# manifest is used to only read files that are new or changed
+store_manifest_columns = ["File Name", "Mtime", "Size"]
 
+# Bring a consolidated store up to date with its files. files has the catalog
+# columns, see catalog.get_catalog_csv_files, read_files returns the store rows
+# of a DataFrame of those files, and store_types gives the store's columns and
+# their types
+def update_store(store_path: str, manifest_path: str, files: pd.DataFrame,
+                 read_files: typing.Callable, store_types: dict):
+    try:
+        manifest = pd.read_parquet(manifest_path)
     except FileNotFoundError:
+        manifest = pd.DataFrame(columns=store_manifest_columns)
+
+    # Files whose name, mtime and size all match the manifest are unchanged
+    unchanged = files.merge(manifest, on=store_manifest_columns, how="inner")["File Name"]
+    if len(unchanged) == len(files) == len(manifest) and os.path.isfile(store_path):
+        return
+
+    # Read the files that are new or changed
+    changed = files[~files["File Name"].isin(unchanged)]
+    frames = [read_files(changed)]
+
+    # Keep the stored rows of unchanged files
+    if len(unchanged) > 0 and os.path.isfile(store_path):
+        frames.insert(0, pd.read_parquet(store_path, filters=[("File Name", "in", list(unchanged))]))
+
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) > 0:
+        store = pd.concat(frames, ignore_index=True)[list(store_types)]
+    else:
+        store = pd.DataFrame(columns=list(store_types))
+    store = store.astype(store_types)
+
+    # Both files are replaced atomically, so other sessions reading them never
+    # see a half-written file. The store is written first, so a manifest never
+    # lists files the store doesn't have
+    catalog.write_parquet(store, store_path, index=False, compression="zstd")
+    catalog.write_parquet(files[store_manifest_columns], manifest_path, index=False)
+
+# Store of every CF and CV sweep in long format, with one row per sweep point
+sweep_store_path = os.path.join(IDC_directory, "sweeps.parquet")
+sweep_manifest_path = os.path.join(IDC_directory, "sweeps_manifest.parquet")
+
+# The sweep axis of each kind of file, which is stored in the "Sweep" column
+sweep_axis_columns = {"CF": "Frequency (Hz)", "CV": "Voltage (V)"}
+sweep_value_columns = ["Capacitance (F)", "Impedance (O)", "Phase Angle (D)"]
+sweep_store_types = {
+    "File Name": "object", "Board ID": "object", "Sensor": "category", "Date": "datetime64[ns]",
+    "Iteration": "int64", "Age": "category", "Kind": "category", "Sweep": "float64",
+    **{column: "float64" for column in sweep_value_columns}
+}
+
+# Get a CF/CV file with its sweep axis column renamed to "Sweep", or None if it
+# can't be read. directory is the file's directory in the catalog
+def get_cf_or_cv_sweep(file_name: str, directory: str):
+    df = get_cf_or_cv(file_name, directory)
+    if df is None:
         return None
 
-    # Cast all columns to numbers
-    df = df.apply(lambda col: pd.to_numeric(col, errors="coerce"))
-    # Drop non-number rows
-    df.dropna(inplace=True)
+    return df.rename(columns={axis: "Sweep" for axis in sweep_axis_columns.values()})
 
-    return df
+# Get many CF/CV files in the long format of the sweep store. The files are read
+# concurrently, and the components of each file name are joined on afterwards
+# from the catalog rows in files
+def get_cf_or_cv_long(files: pd.DataFrame, workers: typing.Optional[int] = None):
+    directories = dict(zip(files["File Name"], files["Directory"]))
+    df = read_batch(files["File Name"], lambda file_name: get_cf_or_cv_sweep(file_name, directories[file_name]),
+                    workers=workers)
+
+    components = files[["File Name", "Board ID", "Sensor", "Date", "Kind", "Iteration", "Age"]]
+    components = components.astype({"Sensor": "object", "Kind": "object", "Age": "object"})
+
+    return df.merge(components, on="File Name", how="left")
+
+# Bring the sweep store up to date with the CF/CV files of the catalog. Files
+# with unconventional names are left out, since their components are unknown
+def update_sweep_store(workers: typing.Optional[int] = None):
+    files = catalog.get_catalog_csv_files(["CF", "CV"])
+    files = files[files["Parsed"]].reset_index(drop=True)
+    update_store(sweep_store_path, sweep_manifest_path, files,
+                 lambda files: get_cf_or_cv_long(files, workers=workers), sweep_store_types)
+
+# Get every CF or CV sweep point from the sweep store, which is updated first.
+# The sweep axis is stored in the "Sweep" column
+def get_cf_or_cv_all(cf_or_cv: typing.Literal["CF", "CV"], columns: typing.Optional[list] = None,
+                     workers: typing.Optional[int] = None):
+    update_sweep_store(workers=workers)
+
+    return pd.read_parquet(sweep_store_path, columns=columns, filters=[("Kind", "==", cf_or_cv)])
+
+# Store of every CurrentTime trace, with one row per sample. Samples are stored
+# as float32, which is plenty for plotting, and halves the size of each trace
+current_time_store_path = os.path.join(IDC_directory, "current_time.parquet")
+current_time_manifest_path = os.path.join(IDC_directory, "current_time_manifest.parquet")
+current_time_store_types = {"File Name": "category", "Current (mA)": "float32", "Time (ms)": "float32"}
+
+# Bring the CurrentTime store up to date with the CurrentTime files of the
+# catalog
+def update_current_time_store(workers: typing.Optional[int] = None):
+    files = catalog.get_catalog_csv_files(["Current"])
+    update_store(current_time_store_path, current_time_manifest_path, files,
+                 lambda files: get_current_time_batch(files["File Name"], workers=workers), current_time_store_types)
+
+# Get the CurrentTime traces of the file names, or of all files if None, from
+# the CurrentTime store, which is updated first
+def get_current_time_all(file_names: typing.Optional[list] = None, workers: typing.Optional[int] = None):
+    update_current_time_store(workers=workers)
+
+    filters = None if file_names is None else [("File Name", "in", list(file_names))]
+    return pd.read_parquet(current_time_store_path, filters=filters)
+
+# Get the directory of the board images of an age
+def get_board_image_directory(age: typing.Literal["EXPOSED", "PRISTINE"]):
+    # edit: ensure correct folder is used based on PRISTINE/EXPOSED
+    if age == "PRISTINE":
+        return os.path.join(IDC_directory, "Imgscans_PRISTINE_templates")
+    else:
+        return os.path.join(IDC_directory, f"Imgscans_{age}")
 
-# Get a board image from the file name
-def get_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+# Decode flags of the supported image scales. An image read at scale n is
+# decoded at 1/n of its width and height, which libjpeg does without decoding
+# the full image, so it's much faster when only statistics are needed
+image_scale_flags = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Get a board image from the file name. scale is one of image_scale_flags
+def get_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], scale: int = 1):
     # edit - original: file_path = f"Imgscans_{age}_edited/{file_name}"
     # file_path = f"../Imgscans_{age}/{file_name}"
     # Return None if file name is invalid
     # if file_name is np.nan or not os.path.isfile(file_path):
     # return None
 
-    # edit: ensure correct folder is used based on PRISTINE/EXPOSED
-    if age == "PRISTINE":
-        directory = os.path.join(IDC_directory, "Imgscans_PRISTINE_templates")
-    else:
-        directory = os.path.join(IDC_directory, f"Imgscans_{age}")
-
     # Read and return file
-    return cv2.imread(os.path.join(directory, file_name))
+    return cv2.imread(os.path.join(get_board_image_directory(age), file_name), image_scale_flags[scale])
+
+# Get the path of a sensor image from the file name
+def get_sensor_image_path(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+    return os.path.join(IDC_directory, f"Imgscans_{age}_sensors", file_name)
 
-# Get a sensor image from the file name
-def get_sensor_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+# Get a sensor image from the file name. scale is one of image_scale_flags
+def get_sensor_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], scale: int = 1):
 
     # edit: check if file name is invalid before continuing
     if file_name is np.nan or not isinstance(file_name, str):
         return None
 
-    sensors_directory = os.path.join(IDC_directory, f"Imgscans_{age}_sensors")
-
     # Read and return file
-    return cv2.imread(os.path.join(sensors_directory, file_name))
+    return cv2.imread(get_sensor_image_path(file_name, age), image_scale_flags[scale])
+
+# Names of the features of an image returned by get_image_features. R, G and B
+# are the channel means, followed by the spread and percentiles of each
+# channel, the fraction of dark pixels, the mean local variance of brightness,
+# and the fraction of edge pixels. Dendrites show as dark, sharp-edged growth
+# between the traces, which a mean over the whole sensor hides
+image_feature_names = ["R", "G", "B"] \
+    + [f"{channel} {statistic}" for channel in "RGB" for statistic in ["Std", "P5", "P50", "P95"]] \
+    + ["Dark Fraction", "Local Variance", "Edge Density"]
+
+# Brightness below which a pixel is dark, out of 255
+dark_threshold = 50
+
+# Width of the square window that local variance is taken over, in pixels
+local_variance_window = 5
+
+# Sobel gradient magnitude, |dx| + |dy|, above which a pixel is an edge
+edge_threshold = 100
+
+# Width and height of the grayscale thumbnail kept for each image. The sensors
+# are cropped from the same coords of every board, so the thumbnails of the
+# pristine and exposed images are aligned and can be differenced pixel by pixel
+image_thumbnail_size = 64
+
+# Get the features of a decoded BGR image, as a tuple in the order of
+# image_feature_names, and its grayscale thumbnail. Everything is taken from
+# the one decoded image: the channel statistics from one histogram per channel,
+# and the rest from one grayscale copy. Costs about as much as the JPEG decode
+def get_image_features(image):
+    pixel_count = image.shape[0] * image.shape[1]
+    levels = np.arange(256)
+
+    means, spreads = [], []
+    # Histograms of the channels in RGB order, since the image is BGR
+    for channel in [2, 1, 0]:
+        histogram = cv2.calcHist([image], [channel], None, [256], [0, 256]).ravel()
+        mean = histogram @ levels / pixel_count
+        variance = histogram @ levels**2 / pixel_count - mean**2
+        percentiles = np.searchsorted(np.cumsum(histogram), np.array([0.05, 0.5, 0.95]) * pixel_count)
+
+        means.append(float(mean))
+        spreads += [float(np.sqrt(max(variance, 0)))] + [float(percentile) for percentile in percentiles]
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    dark_fraction = np.count_nonzero(gray < dark_threshold) / pixel_count
+
+    # Local variance is E[x^2] - E[x]^2 over each window. Its mean over the
+    # image is the mean of x^2, from the histogram, minus the mean of the
+    # squared window means, up to the image borders
+    gray_histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    window_means = cv2.boxFilter(gray, cv2.CV_32F, (local_variance_window, local_variance_window))
+    local_variance = gray_histogram @ levels**2 / pixel_count - cv2.mean(cv2.multiply(window_means, window_means))[0]
+
+    gradient = cv2.add(cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 1, 0)),
+                       cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 0, 1)))
+    edge_density = np.count_nonzero(gradient > edge_threshold) / pixel_count
+
+    thumbnail = cv2.resize(gray, (image_thumbnail_size, image_thumbnail_size), interpolation=cv2.INTER_AREA)
+
+    features = tuple(means + spreads) + (float(dark_fraction), float(local_variance), float(edge_density))
+    return features, thumbnail
+
+# Read the features and thumbnail of an image file, or None if it can't be
+# read. scale is one of image_scale_flags
+def read_image_features(file_path: str, scale: int = 1):
+    image = cv2.imread(file_path, image_scale_flags[scale])
+    if image is None:
+        return None
+
+    return get_image_features(image)
+
+# Cache of sensor image features and thumbnails, keyed by (path, mtime, size,
+# scale), so an image is only decoded again when its file changes. Guarded by a
+# lock because images are read from a thread pool in adds
+image_features_cache = {}
+image_features_cache_counts = {"hits": 0, "misses": 0}
+image_features_cache_lock = threading.Lock()
+
+# Get the hit and miss counts of the sensor image features cache
+def get_image_features_cache_info():
+    with image_features_cache_lock:
+        return {**image_features_cache_counts, "size": len(image_features_cache)}
+
+# Empty the sensor image features cache and reset its counts
+def clear_image_features_cache():
+    with image_features_cache_lock:
+        image_features_cache.clear()
+        image_features_cache_counts.update(hits=0, misses=0)
+
+# Persistent copy of image_features_cache, stored next to master_cached.csv.
+# Paths are stored relative to IDC_directory, so the store can move with the
+# repo. Thumbnails are stored as raw bytes
+image_features_store_path = os.path.join(IDC_directory, "image_features.parquet")
+image_features_store_columns = ["Path", "Mtime", "Size", "Scale"] + image_feature_names + ["Thumbnail"]
+
+# Load the persistent image features store into image_features_cache. Entries
+# are still keyed by mtime and size, so changed images are decoded again
+def load_image_features_store():
+    try:
+        store = pd.read_parquet(image_features_store_path)
+    except FileNotFoundError:
+        return
+
+    # Stores written before a feature was added are rebuilt from the images
+    if not set(image_features_store_columns).issubset(store.columns):
+        return
+
+    thumbnail_shape = (image_thumbnail_size, image_thumbnail_size)
+    with image_features_cache_lock:
+        for path, mtime, size, scale, *features, thumbnail in store[image_features_store_columns].itertuples(
+                index=False):
+            key = (os.path.join(IDC_directory, path), int(mtime), int(size), int(scale))
+            # Missing thumbnails are stored for images that couldn't be read
+            if thumbnail is None:
+                image_features_cache[key] = None
+            else:
+                image_features_cache[key] = (tuple(features),
+                                             np.frombuffer(thumbnail, dtype=np.uint8).reshape(thumbnail_shape))
+
+# Write the entries of image_features_cache whose files are unchanged to the
+# persistent image features store
+def save_image_features_store():
+    with image_features_cache_lock:
+        cached = list(image_features_cache.items())
+
+    rows = []
+    for (file_path, mtime, size, scale), value in cached:
+        # Drop entries for files that were removed or have changed since
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+            continue
+
+        if value is None:
+            features, thumbnail = (np.nan,) * len(image_feature_names), None
+        else:
+            features, thumbnail = value[0], value[1].tobytes()
+        rows.append((os.path.relpath(file_path, IDC_directory), mtime, size, scale, *features, thumbnail))
+
+    store = pd.DataFrame(rows, columns=image_features_store_columns)
+    store.to_parquet(image_features_store_path, index=False)
+
+# Get the features and thumbnail of a sensor image, see get_image_features, or
+# None if it can't be read. scale is one of image_scale_flags. Results are
+# cached, see image_features_cache
+def get_sensor_image_features(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], scale: int = 1):
+    if not isinstance(file_name, str):
+        return None
+
+    file_path = get_sensor_image_path(file_name, age)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+
+    # Return the cached features if this version of the file was already read
+    key = (file_path, stat.st_mtime_ns, stat.st_size, scale)
+    with image_features_cache_lock:
+        if key in image_features_cache:
+            image_features_cache_counts["hits"] += 1
+            return image_features_cache[key]
+        image_features_cache_counts["misses"] += 1
+
+    value = read_image_features(file_path, scale)
+
+    with image_features_cache_lock:
+        image_features_cache[key] = value
+
+    return value
@@ -8,6 +8,7 @@ import os
 import pandas as pd
 import seaborn as sns
 import adds
+import figures
 import matplotlib.pyplot as plt
 import plotly.express as px
 
@@ -32,16 +33,53 @@ st.set_page_config(layout="wide", page_title="IDC Analysis Plotting Hub", page_i
 st.title("IDC Analysis Plotting Hub")
 
 
+# DATA -----------------------------------------------------------------------------------------------------------------
+# adds memoizes the pipeline, and rebuilds it when source files change. Panels must treat the data they get as
+# read-only, so they use non-inplace operations. CF/CV aggregates come from the cubes that adds materializes at ingest
+# time, so panels never rescan the sweeps.
+
+# Get the average CF or CV data for each sensor and frequency/voltage, taken across all boards
+def get_cf_or_cv_average(cf_or_cv):
+    average=adds.query_cf_or_cv_cube(cf_or_cv, by=["Sensor"])
+    return average.rename(columns={f"{column} Mean": column
+                                   for column in ["Capacitance (F)", "Impedance (O)", "Phase Angle (D)"]})
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+# PANELS ---------------------------------------------------------------------------------------------------------------
+# Each panel is only drawn when its Render toggle is on, and expensive panels are off by default. Panels are rendered in
+# fragments, so interacting with a panel's widgets only reruns that panel, not the whole hub.
+
+# Show a toggle to turn a panel on and off, and draw the panel if it is on
+def render_if_on(key, panel, *args, expensive=False):
+    if st.toggle("Render", value=not expensive, key=f"render_{key}"):
+        panel(*args)
+    else:
+        st.caption("Turn on Render to draw this plot")
+
+# Draw a panel in its own fragment. See render_if_on
+@st.fragment
+def render_panel(key, panel, *args, expensive=False):
+    render_if_on(key, panel, *args, expensive=expensive)
+
+# Decorate a panel function that yields matplotlib figures, so that its figures are drawn from the figure cache. The
+# panel function is only called when no figures are cached for the panel's name, filter values, and data version, which
+# is returned by get_version
+def cached_figures(panel, get_version):
+    def decorator(plot):
+        def draw(*filters):
+            key=(panel, filters, get_version())
+            for png in figures.get_figure_pngs(key, lambda: plot(*filters)):
+                st.image(png, use_container_width=True)
+        return draw
+    return decorator
+# ----------------------------------------------------------------------------------------------------------------------
+
+
 # SIDEBAR --------------------------------------------------------------------------------------------------------------
 st.sidebar.title("Plotting Options")
 with st.sidebar:
 
-    # filter by solution type for image analysis plots
-    st.header("Image Analysis Filters")
-    option1=st.selectbox("Solution:", ["DI Water", "Adipic Acid - 1.24mM", "Adipic Acid - 0.712mM","Succinic 0.388mM",
-                                      "Succinic 20mM","Succinic 1.425mM","Succinic 0.712 mM","Succinic 3.6mM",
-                                      "Adipic Acid - 0.388mM"])
-
     # filter by pattern for failure time vs solution plots
     st.header("Failure Time vs Solution Filters")
     option2=st.selectbox("Pattern:",["1","4","7","10"])
@@ -58,125 +96,127 @@ column1, column2=st.columns(2)
 
 with column1:
 
-    # RGB 3D Plot ----------------------------------------------------------------------------------------------------------
-    with st.container(border=True):
-        st.header("3D RGB Analysis")
-        st.text("Maps RGB values to XYZ coordinates to view the average color of all boards, "
-                "separated by board type and pristine/exposed")
-        def RGB_3D(option1):
-            master=adds.get_master()
-            master.dropna(subset="Pattern", inplace=True)
-
-            # filter by solution choice
-            master=master[master["Solution"]==option1]
+    # Image analysis panels share the Solution filter, so they are drawn in one fragment with it. Changing the filter
+    # only reruns these panels
+    @st.fragment
+    def image_analysis():
 
-            master["Pattern"]=master["Pattern"].apply(int).apply(str)
+        # filter by solution type for image analysis plots
+        option1=st.selectbox("Solution:", ["DI Water", "Adipic Acid - 1.24mM", "Adipic Acid - 0.712mM",
+                                          "Succinic 0.388mM", "Succinic 20mM", "Succinic 1.425mM", "Succinic 0.712 mM",
+                                          "Succinic 3.6mM", "Adipic Acid - 0.388mM"])
 
-            # Melt the RGB columns
-            master=master.melt(id_vars=["Pattern", "Board ID", "Sensor"],
-                                 value_vars=["R_PRISTINE", "G_PRISTINE", "B_PRISTINE", "R_EXPOSED", "G_EXPOSED",
-                                             "B_EXPOSED"],
-                                 var_name="Channel_Age", value_name="Value")
+        # RGB 3D Plot --------------------------------------------------------------------------------------------------
+        with st.container(border=True):
+            st.header("3D RGB Analysis")
+            st.text("Maps RGB values to XYZ coordinates to view the average color of all boards, "
+                    "separated by board type and pristine/exposed")
+            def RGB_3D(option1):
+                master=adds.get_master_rgb()
+                master=master.dropna(subset="Pattern")
 
-            # Split "Channel_Age" into "Channel" and "Age"
-            master[["Channel", "Age"]]=master["Channel_Age"].str.extract(r"([RGB])_(PRISTINE|EXPOSED)")
+                # filter by solution choice
+                master=master[master["Solution"]==option1]
 
-            # Pivot to get R, G, B in separate columns, with "Age" as one of the columns
-            master=master.pivot_table(index=["Pattern", "Board ID", "Sensor", "Age"], columns="Channel",
-                                        values="Value"
-                                        ).reset_index()
+                master=master.assign(Pattern=master["Pattern"].apply(int).apply(str))
 
-            fig=px.scatter_3d(master, x="R", y="G", z="B", color="Pattern", symbol="Age",
-                                symbol_map={"PRISTINE": "circle-open", "EXPOSED": "circle"}, opacity=0.6,
-                                hover_data=["Pattern", "Board ID", "Sensor"])
+                fig=px.scatter_3d(master, x="R", y="G", z="B", color="Pattern", symbol="Age",
+                                    symbol_map={"PRISTINE": "circle-open", "EXPOSED": "circle"}, opacity=0.6,
+                                    hover_data=["Pattern", "Board ID", "Sensor"])
 
-            st.plotly_chart(fig)
+                st.plotly_chart(fig)
 
 
-        RGB_3D(option1)
-    # ----------------------------------------------------------------------------------------------------------------------
+            render_if_on("rgb_3d", RGB_3D, option1)
+        # --------------------------------------------------------------------------------------------------------------
 
 
 
-    # RGB Boxplots ---------------------------------------------------------------------------------------------------------
-    with st.container(border=True):
-        st.header("RGB Boxplots")
-        st.text("Plots the differences in average RGB channels for pristine VS exposed boards")
-        def RGB_boxplots(option1):
-            master=adds.get_master()
+        # RGB Boxplots -------------------------------------------------------------------------------------------------
+        with st.container(border=True):
+            st.header("RGB Boxplots")
+            st.text("Plots the differences in average RGB channels for pristine VS exposed boards")
+            @cached_figures("rgb_boxplots", adds.get_master_version)
+            def RGB_boxplots(option1):
+                master=adds.get_master()
 
-            # filter by solution choice
-            master=master[master["Solution"]==option1]
+                # filter by solution choice
+                master=master[master["Solution"]==option1]
 
-            # Add columns for RGB difference
-            master["Red"]=master["R_EXPOSED"]-master["R_PRISTINE"]
-            master["Green"]=master["G_EXPOSED"]-master["G_PRISTINE"]
-            master["Blue"]=master["B_EXPOSED"]-master["B_PRISTINE"]
+                # Add columns for RGB difference
+                master=master.assign(Red=master["R_EXPOSED"]-master["R_PRISTINE"],
+                                     Green=master["G_EXPOSED"]-master["G_PRISTINE"],
+                                     Blue=master["B_EXPOSED"]-master["B_PRISTINE"])
 
-            # Convert to long for easy plotting
-            # A channel column will be added, storing "R_Diff"...
-            master=pd.melt(master, id_vars=["Board ID", "Sensor", "Pattern"], value_vars=["Red", "Green", "Blue"],
-                             var_name="Channel", value_name="Channel Difference")
+                # Convert to long for easy plotting
+                # A channel column will be added, storing "R_Diff"...
+                master=pd.melt(master, id_vars=["Board ID", "Sensor", "Pattern"], value_vars=["Red", "Green", "Blue"],
+                                 var_name="Channel", value_name="Channel Difference")
 
-            # Create a FacetGrid
-            g=sns.FacetGrid(data=master, col="Channel", margin_titles=True, hue="Channel",
-                              palette={"Red": "#FF0000", "Green": "#00FF00", "Blue": "#0000FF"})
+                # Create a FacetGrid
+                g=sns.FacetGrid(data=master, col="Channel", margin_titles=True, hue="Channel",
+                                  palette={"Red": "#FF0000", "Green": "#00FF00", "Blue": "#0000FF"})
 
-            # Create a lineplot on the FacetGrid
-            g.map_dataframe(sns.boxplot, x="Pattern", y="Channel Difference", )
+                # Create a lineplot on the FacetGrid
+                g.map_dataframe(sns.boxplot, x="Pattern", y="Channel Difference", )
 
-            # Set the text of the titles
-            g.set_titles(col_template="{col_name}")
+                # Set the text of the titles
+                g.set_titles(col_template="{col_name}")
 
-            # Set ticks to ints, not floats
-            g.set_xticklabels([1, 4, 7, 10])
+                # Set ticks to ints, not floats
+                g.set_xticklabels([1, 4, 7, 10])
 
-            st.pyplot(g)
+                yield g.figure
 
 
-        RGB_boxplots(option1)
-    # ----------------------------------------------------------------------------------------------------------------------
+            render_if_on("rgb_boxplots", RGB_boxplots, option1)
+        # --------------------------------------------------------------------------------------------------------------
 
 
 
-    # Grayscale Boxplots ---------------------------------------------------------------------------------------------------
-    with st.container(border=True):
-        st.header("Grayscale Boxplots")
-        st.text("Plots the average brightness of each board")
-        def grayscale(option1):
-            master=adds.get_master()
+        # Grayscale Boxplots -------------------------------------------------------------------------------------------
+        with st.container(border=True):
+            st.header("Grayscale Boxplots")
+            st.text("Plots the average brightness of each board")
+            @cached_figures("grayscale", adds.get_master_version)
+            def grayscale(option1):
+                master=adds.get_master()
 
-            master=master[master["Solution"]==option1]
+                master=master[master["Solution"]==option1]
 
-            # Add column for brightness difference
-            master["Brightness Difference"]=master["Brightness Exposed"] - master["Brightness Pristine"]
+                # Add column for brightness difference, and make pattern categorical and ordered to make sure it is
+                # plotted correctly
+                master=master.assign(**{
+                    "Brightness Difference": master["Brightness Exposed"] - master["Brightness Pristine"],
+                    "Pattern": pd.Categorical(master["Pattern"], categories=[1, 4, 7, 10], ordered=True)})
 
-            # make pattern categorical and ordered to make sure it is plotted correctly
-            master["Pattern"]=pd.Categorical(master["Pattern"], categories=[1, 4, 7, 10], ordered=True)
+                # plot
+                fig, ax=plt.subplots(figsize=(10, 6))
+                sns.boxplot(data=master, x="Pattern", y="Brightness Difference", ax=ax)
+                yield fig
 
-            # plot
-            fig, ax=plt.subplots(figsize=(10, 6))
-            sns.boxplot(data=master, x="Pattern", y="Brightness Difference", ax=ax)
-            st.pyplot(fig)
 
+            render_if_on("grayscale", grayscale, option1)
+        # --------------------------------------------------------------------------------------------------------------
 
-        grayscale(option1)
+    image_analysis()
     # ----------------------------------------------------------------------------------------------------------------------
 
     # Failure Time vs Solution ---------------------------------------------------------------------------------------------
     with st.container(border=True):
         st.header("Failure Time vs Solution")
         st.text("Plots failure time as function of solution, separated by board type and sensor")
+        @cached_figures("failure_time", adds.get_master_version)
         def failure_time():
 
             # Get master data
             master=adds.get_master()
 
             # Drop NaN rows
-            master.dropna(subset="Voltage", inplace=True)
+            master=master.dropna(subset="Voltage")
 
             # Add column to store failure time in seconds
-            master["Failure Time (s)"]=master["Time to Failure (ms)"] / 1000
+            master=master.assign(**{"Failure Time (s)": master["Time to Failure (ms)"] / 1000})
 
             # Plot data for each unique voltage
             for voltage in master["Voltage"].unique():
@@ -213,10 +253,10 @@ with column1:
                 # Adjust spacing
                 g.figure.subplots_adjust(left=0.06, bottom=0.08, right=0.91, top=0.94)
 
-                st.pyplot(g.figure)
+                yield g.figure
 
 
-        failure_time()
+        render_panel("failure_time", failure_time, expensive=True)
     # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -227,18 +267,20 @@ with column2:
     with st.container(border=True):
         st.header("Scatterplot Matrix")
         st.text("Plots a scatterplot matrix for all variable pairs")
+        @cached_figures("scatter", adds.get_master_version)
         def scatter():
             # Get master data
             master=adds.get_master()
 
-            master["Brightness Difference"] = master["Brightness Exposed"] - master["Brightness Pristine"]
+            master=master.assign(**{
+                "Brightness Difference": master["Brightness Exposed"] - master["Brightness Pristine"]})
 
             master=master[
                 ["Pattern", "Time to Failure (ms)", "Voltage", "pH", "Dendrite Score", "Brightness Pristine",
                  "Brightness Exposed", "Brightness Difference"]]
 
             # Drop NA values
-            master.dropna(axis=1, how="all", inplace=True)
+            master=master.dropna(axis=1, how="all")
 
             # Drop non-numeric columns
             master=master.select_dtypes(include=["number"])
@@ -255,10 +297,10 @@ with column2:
             fig=axes[0, 0].get_figure()
             plt.tight_layout()
 
-            st.pyplot(fig)
+            yield fig
 
 
-        scatter()
+        render_panel("scatter", scatter, expensive=True)
     # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -267,17 +309,19 @@ with column2:
     with st.container(border=True):
         st.header("Correlation Heatmap")
         st.text("Plots the correlations between all variable pairs")
+        @cached_figures("heatmap", adds.get_master_version)
         def heatmap():
             # Get master
             master=adds.get_master()
-            master["Brightness Difference"] = master["Brightness Exposed"] - master["Brightness Pristine"]
+            master=master.assign(**{
+                "Brightness Difference": master["Brightness Exposed"] - master["Brightness Pristine"]})
             # edited
             master=master[
                 ["Pattern", "Time to Failure (ms)", "Voltage", "pH", "Dendrite Score", "Brightness Pristine",
                  "Brightness Exposed", "Brightness Difference"]]
 
             # Drop columns that are entirely NaN
-            master.dropna(axis=1, how="all", inplace=True)
+            master=master.dropna(axis=1, how="all")
             # Drop columns that are non-numeric
             master=master.select_dtypes(include=["number"])
 
@@ -285,10 +329,10 @@ with column2:
             fig, ax=plt.subplots()
             sns.heatmap(master.corr(), annot=True, cmap="coolwarm", ax=ax)
             plt.tight_layout()
-            st.pyplot(fig)
+            yield fig
 
 
-        heatmap()
+        render_panel("heatmap", heatmap)
     # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -297,6 +341,7 @@ with column2:
     with st.container(border=True):
         st.header("pH Plot")
         st.text("Plots failure time as a function of pH")
+        @cached_figures("ph", adds.get_master_version)
         def plot_ph():
             df=adds.get_master()
 
@@ -315,10 +360,10 @@ with column2:
 
             # Tight layout so the legend doesn't get cut off
             plt.tight_layout()
-            st.pyplot(fig)
+            yield fig
 
 
-        plot_ph()
+        render_panel("ph", plot_ph)
 
     # ----------------------------------------------------------------------------------------------------------------------
 
@@ -326,32 +371,17 @@ with column2:
     with st.container(border=True):
         st.header("CF and CV Plots")
         st.text("Plots CF and CV Data")
+        @cached_figures("cf_cv", lambda: (adds.get_cf_or_cv_cube_version("CF"), adds.get_cf_or_cv_cube_version("CV")))
         def CF_CV():
 
-            # get CF and CV data
-            CF=adds.get_master_cf_or_cv(cf_or_cv="CF")
-            CV=adds.get_master_cf_or_cv(cf_or_cv="CV")
-
-            # filter out files with bad data
-            CF=CF[(CF["Capacitance (F)"]>0)&(CF["Capacitance (F)"]<100)]
-            CV=CV[(CV["Capacitance (F)"]>0)&(CV["Capacitance (F)"]<100)]
+            # get the average CF and CV data of each sensor
+            CF_average=get_cf_or_cv_average("CF")
+            CV_average=get_cf_or_cv_average("CV")
 
             # list of sensor names and colors for plotting
             sensors=["U1", "U2", "U3", "U4"]
             colors=["c", "m", "y", "#47E183"]
 
-            # take the average across all data for each sensor and frequency for CF data
-            if CF is not None and not CF.empty:
-                CF_average=CF.groupby(["Sensor", "Frequency (Hz)"]).agg(
-                    {"Capacitance (F)": "mean", "Impedance (O)": "mean",
-                     "Phase Angle (D)": "mean"}).reset_index()
-
-            # take the average across all data for each sensor and voltage for CV data
-            if CV is not None and not CV.empty:
-                CV_average=CV.groupby(["Sensor", "Voltage (V)"]).agg(
-                    {"Capacitance (F)": "mean", "Impedance (O)": "mean",
-                     "Phase Angle (D)": "mean"}).reset_index()
-
             # create figure and subplots
             fig, axes=plt.subplots(2, 3, figsize=(15, 8))
 
@@ -421,9 +451,9 @@ with column2:
             ax6.legend()
 
             plt.tight_layout()
-            st.pyplot(fig)
+            yield fig
 
-        CF_CV()
+        render_panel("cf_cv", CF_CV)
     # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -432,13 +462,17 @@ with column2:
     with st.container(border=True):
         st.header("Current vs Time")
         st.text("Plots current as a function of time for each tested sensor separated by solution and board type")
+        @cached_figures("current_vs_time", adds.get_current_time_version)
         def current_vs_time():
 
-            # Get joined data
-            master_current_time=adds.get_master_current_time()
+            # Get joined data, with only the master columns used for plotting. Traces are decimated to about one bucket
+            # per 4 pixels of a 3 inch facet at 200 dpi, since more points than that can't be seen
+            master_current_time=adds.get_master_current_time(
+                columns=["Board ID", "Sensor", "Pattern", "Solution", "Voltage"], buckets=150)
 
             # Add a unique sensor identifier
-            master_current_time["Sensor ID"]=master_current_time["Board ID"] + "_" + master_current_time["Sensor"]
+            master_current_time=master_current_time.assign(**{
+                "Sensor ID": master_current_time["Board ID"] + "_" + master_current_time["Sensor"].astype(str)})
 
             # Plot data for each unique voltage
             for voltage in master_current_time["Voltage"].unique():
@@ -475,10 +509,10 @@ with column2:
                 # Add main title
                 g.figure.suptitle(f"Current Vs Time, by Solution, Pattern, and Sensor ({int(voltage)}V)")
 
-                st.pyplot(g.figure)
+                yield g.figure
 
 
-        current_vs_time()
+        render_panel("current_vs_time", current_vs_time, expensive=True)
     # ----------------------------------------------------------------------------------------------------------------------
 
 
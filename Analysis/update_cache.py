@@ -1,3 +1,57 @@
 import adds
+import reads
+import failures
+import argparse
+import typing
 
-adds.get_master(from_cache=False).to_csv("master_cached.csv", index=False)
+# Rebuild the cached master data and the CF/CV cubes, and report failures and
+# measurement files that disagree with master. The rebuild runs here, behind
+# the __main__ guard, so worker processes that import this file don't rerun it
+def main(args: typing.Optional[list] = None):
+    parser = argparse.ArgumentParser(prog="python update_cache.py", description="Rebuild the cached master data.")
+    parser.add_argument("--from-boards", action="store_true",
+                        help="compute the image means from the board images instead of the cropped sensor images")
+    parser.add_argument("--image-scale", type=int, choices=list(reads.image_scale_flags), default=1,
+                        help="decode the sensor images at 1/n scale for the image means (default: 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of workers reading the images and CurrentTime files (default: automatic)")
+    arguments = parser.parse_args(args)
+
+    # Read the previous cache first, so the values that can't be rebuilt from
+    # the files on disk are kept, such as the image features of sensors whose
+    # images aren't in the repository
+    cached = reads.get_master_cached()
+
+    master = adds.get_master(from_cache=False, workers=arguments.workers, from_boards=arguments.from_boards,
+                             image_scale=arguments.image_scale)
+    master = adds.keep_cached_values(master, cached)
+    master = reads.cast_master_types(master)
+
+    # Write the Parquet cache, which is read first, and the CSV fallback/export
+    master.to_parquet(reads.master_cached_parquet_path, index=False)
+    master.to_csv(reads.master_cached_csv_path, index=False)
+
+    # Materialize the CF/CV cubes from the new cache
+    for cf_or_cv in ["CF", "CV"]:
+        adds.update_cf_or_cv_cube(cf_or_cv)
+
+    # Report sensors whose detected time to failure disagrees with the manual one
+    disagreements = failures.get_failure_disagreements(master)
+    if len(disagreements):
+        print(f"{len(disagreements)} detected times to failure disagree with Time to Failure (ms):")
+        print(disagreements.to_string(index=False))
+
+    # Report master rows missing measurement files, and files matching no master row
+    report = adds.get_measurement_report(master)
+    if len(report):
+        print("Measurement files not matched with master:")
+        print(report.groupby(["Column", "Status"], observed=True).size().unstack(fill_value=0).to_string())
+
+    # Report the Current cells of the masterlist that held readings instead of file
+    # names, which are kept in their own column
+    readings = master[adds.current_reading_column].notna().sum()
+    if readings:
+        print(f"{readings} Current cells held readings instead of file names, moved to {adds.current_reading_column}")
+
+if __name__ == "__main__":
+    main()
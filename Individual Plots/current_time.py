@@ -10,11 +10,15 @@ import seaborn as sns
 # Required to show plt plots in Streamlit
 matplotlib.use("TkAgg")
 
-# Get joined data
-master_current_time = adds.get_master_current_time()
+# Get joined data, with only the master columns used for plotting. Traces are
+# decimated to 150 buckets of time each, which keeps their shape at plot size
+master_current_time = adds.get_master_current_time(
+    columns=["Board ID", "Sensor", "Pattern", "Solution", "Voltage"],
+    buckets=150
+)
 
 # Add a unique sensor identifier
-master_current_time["Sensor ID"] = master_current_time["Board ID"] + "_" + master_current_time["Sensor"]
+master_current_time["Sensor ID"] = master_current_time["Board ID"] + "_" + master_current_time["Sensor"].astype(str)
 
 # Plot Data --------------------------------------------------------------------
 # Plot for each unique voltage
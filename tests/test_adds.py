@@ -0,0 +1,38 @@
+# Regression tests of adds, run on the shipped data with python -m pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Analysis"))
+
+import adds
+import reads
+
+
+# Add the image file names with one boolean mask over master per file, the way
+# get_master did before the names were merged in
+def add_image_names_by_mask(master):
+    master = master.copy()
+
+    for file_name in sorted(os.listdir(os.path.join(reads.IDC_directory, "Imgscans_PRISTINE_sensors"))):
+        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
+        mask = (master["Pattern"] == float(pattern)) & (master["Sensor"] == sensor)
+        master.loc[mask, "Image_PRISTINE"] = file_name
+
+    for file_name in sorted(os.listdir(os.path.join(reads.IDC_directory, "Imgscans_EXPOSED_sensors"))):
+        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
+        mask = (master["Board ID"] == "_".join([batch, pattern, id])) & (master["Sensor"] == sensor)
+        master.loc[mask, "Image_EXPOSED"] = file_name
+
+    return master
+
+
+def test_image_names_match_mask_reference():
+    master = reads.get_master()
+
+    merged = adds.add_image_names(master)
+    reference = add_image_names_by_mask(master)
+
+    for column in ["Image_PRISTINE", "Image_EXPOSED"]:
+        assert merged[column].notna().any()
+        assert merged[column].fillna("").tolist() == reference[column].fillna("").tolist()